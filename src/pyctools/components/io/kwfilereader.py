@@ -16,22 +16,43 @@
 #  along with this program.  If not, see
 #  <http://www.gnu.org/licenses/>.
 
-__all__ = ['KWFileReader']
+__all__ = ['KWFileReader', 'probe']
 __docformat__ = 'restructuredtext en'
 
-from collections import namedtuple
+import bisect
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 import enum
+from functools import partial
+import glob
+import hashlib
 import io
+import logging
+import math
 import os
+import re
 import struct
+import sys
+import tempfile
+import threading
+import time
 
 import numpy
 
-from pyctools.core.config import ConfigBool, ConfigPath
+from pyctools.core.config import (
+    ConfigBool, ConfigEnum, ConfigInt, ConfigPath, ConfigStr)
 from pyctools.core.base import Component
 from pyctools.core.frame import Metadata
 from pyctools.core.types import pt_float
 
+logger = logging.getLogger(__name__)
+
+#: Directory where converted frames are stored if
+#: :py:class:`KWFileReader`'s ``cache`` option is set.
+frame_cache_dir = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'pyctools-jim', 'kwframes')
 
 PicFile = namedtuple('PicFile',
                      ('comps', 'interleave',
@@ -61,18 +82,611 @@ class DataTypes(enum.Enum):
     ps_tng_BYTE = 5
 
 
+KWFileInfo = namedtuple('KWFileInfo', ('header', 'audit', 'format', 'data_start'))
+
+# KW header integer tags (tag, count) and the values they store
+kw_int_tags = {
+    (33, 1): (None,),
+    (34, 2): ('comps', 'interleave'),
+    (35, 1): ('chroma_phase',),
+    (36, 4): ('full_width', 'full_height', 'field_freq', 'interlace'),
+    (37, 4): ('active_width', 'active_height', 'aspect_width', 'aspect_height'),
+    (38, 2): ('over_bits', 'acc_bits'),
+    (39, 4): ('min_lum', 'max_lum', 'min_chrom', 'max_chrom'),
+    (40, 3): ('pos_x', 'pos_y', 'pos_z'),
+    (41, 3): ('len_x', 'len_y', 'len_z'),
+    }
+
+
+def probe(path):
+    """Read the header of a KW or pic-pipe file.
+
+    The header is fetched with one read (more are needed only if it is
+    unusually large) and parsed from memory.
+
+    :param str path: Path name of file to be read.
+
+    :return: The file's :py:class:`PicFile` header, its audit trail
+        lines, its format (``'KW'``, ``'PIC-pipe'`` or ``'PIC-PIPE'``),
+        and the file position of the start of the picture data.
+
+    :rtype: :py:class:`KWFileInfo`
+
+    :raises ValueError: If the file is not a KW or pic-pipe file, or its
+        header is incomplete.
+
+    """
+    block_size = 4096
+    with open(path, 'rb') as pf:
+        while True:
+            pf.seek(0)
+            data = pf.read(block_size)
+            try:
+                return parse_header(memoryview(data))
+            except (IndexError, struct.error):
+                if len(data) < block_size:
+                    raise ValueError('Truncated header')
+                if block_size >= 2 ** 24:
+                    raise ValueError('Header too large')
+            block_size *= 16
+
+
+def parse_header(buf):
+    if buf[0] == 16:
+        header, audit, pos = parse_kw_header(buf)
+        fmt = 'KW'
+    else:
+        fmt = bytes(buf[:8]).decode('ascii', errors='replace')
+        if fmt not in ('PIC-pipe', 'PIC-PIPE'):
+            raise ValueError('Unrecognised header {!r}'.format(fmt))
+        header, audit, pos = parse_pic_pipe_header(buf, fmt == 'PIC-PIPE')
+    return KWFileInfo(header, audit, fmt, pos)
+
+
+def parse_kw_header(buf):
+    audit = []
+    header = {'data_type': DataTypes.ps_tng_KW, 'precision': 0}
+    pos = 1
+    while True:
+        tag1 = buf[pos]
+        pos += 1
+        if tag1 == 24:
+            # two-byte integer values
+            tag2, count = buf[pos], buf[pos + 1]
+            values = struct.unpack_from('<{}h'.format(count), buf, pos + 2)
+            pos += 2 + (count * 2)
+            if (tag2, count) in kw_int_tags:
+                header.update(zip(kw_int_tags[(tag2, count)], values))
+            else:
+                logger.warning(
+                    'Unrecognised KW int code %d or count %d', tag2, count)
+        elif tag1 == 28:
+            # string value
+            tag2, count = buf[pos], buf[pos + 1]
+            value = struct.unpack_from('{}s'.format(count), buf, pos + 2)[0]
+            value = value.decode('ascii')
+            pos += 2 + count
+            if tag2 == 97:
+                audit.append(value)
+            elif tag2 == 98:
+                header['pic_name'] = value
+            elif tag2 == 99:
+                header['code'] = value
+            else:
+                logger.warning('Unrecognised KW string code %d', tag2)
+        elif tag1 == 32:
+            # end of header
+            break
+        else:
+            # can't find the next tag, so this isn't a KW header
+            raise ValueError('Unrecognised KW tag {}'.format(tag1))
+    header.pop(None, None)
+    missing = [x for x in PicFile._fields if x not in header]
+    if missing:
+        raise ValueError('KW header has no {}'.format(', '.join(missing)))
+    header['precision'] = ((header['acc_bits'] + 7) // 8) * 8
+    return PicFile(**header), audit, pos
+
+
+def parse_pic_pipe_header(buf, big_endian):
+    endian = ('<', '>')[big_endian]
+    count = struct.unpack_from(endian + 'i', buf, 8)[0]
+    header = PicFile(*struct.unpack_from(endian + PicFile_fmt, buf, 16))
+    header = header._replace(
+        pic_name=header.pic_name.decode('ascii').strip('\0'),
+        code=header.code.decode('ascii').strip('\0'),
+        data_type=DataTypes(header.data_type))
+    pos = 12 + count
+    # read audit trail
+    audit = []
+    while True:
+        count = struct.unpack_from(endian + 'i', buf, pos)[0]
+        pos += 4
+        if count == 0:
+            break
+        line = struct.unpack_from('80s', buf, pos)[0]
+        audit.append(line[:count].decode('ascii'))
+        pos += 80
+    return header, audit, pos
+
+
+def unpack_int24(raw_data, big_endian, out):
+    """Unpack 3-byte signed integer samples.
+
+    :param raw_data: The packed data.
+
+    :param bool big_endian: The byte order of ``raw_data``.
+
+    :param numpy.ndarray out: A contiguous :py:class:`numpy.int32`
+        array to store the result.
+
+    :rtype: :py:class:`numpy.ndarray`
+
+    """
+    raw_data = numpy.frombuffer(raw_data, dtype=numpy.uint8).reshape(-1, 3)
+    if big_endian:
+        raw_data = raw_data[:, ::-1]
+    # view output as bytes, least significant first
+    dest = out.reshape(-1).view(numpy.uint8).reshape(-1, 4)
+    if sys.byteorder == 'big':
+        dest = dest[:, ::-1]
+    dest[:, :3] = raw_data
+    # sign extend
+    numpy.right_shift(raw_data[:, 2].view(numpy.int8), 7,
+                      out=dest[:, 3].view(numpy.int8))
+    return out
+
+
+def unpack_bits(raw_data, bits, big_endian, out):
+    """Unpack signed integer samples stored with no unused bits.
+
+    Big endian data is packed most significant bit first, little endian
+    data least significant bit first. Samples are unpacked in groups
+    that occupy a whole number of bytes, so the work is done by a few
+    numpy operations on each sample position within a group.
+
+    :param raw_data: The packed data.
+
+    :param int bits: The number of bits per sample, up to 32.
+
+    :param bool big_endian: The bit order of ``raw_data``.
+
+    :param numpy.ndarray out: A contiguous :py:class:`numpy.int32`
+        array to store the result. Its length must be a multiple of the
+        number of samples in a group.
+
+    :rtype: :py:class:`numpy.ndarray`
+
+    """
+    group = 8 // math.gcd(bits, 8)
+    group_bytes = bits * group // 8
+    out = out.reshape(-1, group)
+    n_groups = out.shape[0]
+    raw_data = numpy.frombuffer(raw_data, dtype=numpy.uint8)
+    if raw_data.shape[0] < n_groups * group_bytes:
+        raw_data = numpy.concatenate((raw_data, numpy.zeros(
+            (n_groups * group_bytes) - raw_data.shape[0], dtype=numpy.uint8)))
+    raw_data = raw_data[:n_groups * group_bytes].reshape(n_groups, group_bytes)
+    acc_type = (numpy.uint32, numpy.uint64)[bits > 25]
+    for j in range(group):
+        first, shift = divmod(j * bits, 8)
+        n_bytes = (shift + bits + 7) // 8
+        acc = raw_data[:, first].astype(acc_type)
+        for k in range(1, n_bytes):
+            if big_endian:
+                acc <<= 8
+                acc |= raw_data[:, first + k]
+            else:
+                acc |= raw_data[:, first + k].astype(acc_type) << (8 * k)
+        if big_endian:
+            acc >>= (8 * n_bytes) - shift - bits
+        else:
+            acc >>= shift
+        acc &= (1 << bits) - 1
+        numpy.copyto(out[:, j], acc, casting='unsafe')
+    out = out.reshape(-1)
+    if bits < 32:
+        # sign extend
+        sign = 1 << (bits - 1)
+        out ^= sign
+        out -= sign
+    return out
+
+
+class BufferPool(object):
+    """Reusable output arrays.
+
+    Arrays are returned to the pool when nothing else holds a reference
+    to them, including any view of them. This saves the cost of
+    allocating (and page faulting) a new large array for every frame.
+
+    """
+    def __init__(self, shape, dtype):
+        self.shape = shape
+        self.dtype = dtype
+        self.buffers = []
+        self.lock = threading.Lock()
+        # reference count of an array held only by the pool
+        self.buffers.append(numpy.empty(shape, dtype=dtype))
+        self.free_count = self._ref_count(0)
+
+    def _ref_count(self, idx):
+        return sys.getrefcount(self.buffers[idx])
+
+    def get(self):
+        """Get an unused array (thread-safe).
+
+        :rtype: :py:class:`numpy.ndarray`
+
+        """
+        with self.lock:
+            for idx in range(len(self.buffers)):
+                if self._ref_count(idx) <= self.free_count:
+                    return self.buffers[idx]
+            self.buffers.append(numpy.empty(self.shape, dtype=self.dtype))
+            return self.buffers[-1]
+
+
+class DataFile(object):
+    """Picture data of one file of a sequence.
+
+    The file is opened when it is first read. Closing it is deferred
+    until any reads in progress (in other threads) have finished, and
+    it is opened again if it's needed after being closed.
+
+    """
+    def __init__(self, path, data_start, len_z, bytes_per_frame, memmap):
+        self.path = path
+        self.data_start = data_start
+        self.len_z = len_z
+        self.bytes_per_frame = bytes_per_frame
+        self.memmap = memmap
+        self.lock = threading.Lock()
+        self.pf = None
+        self.file_data = None
+        self.cache = None
+        self.users = 0
+        self.closing = False
+
+    def read(self, z, region=None):
+        """Read one frame of raw data (thread-safe).
+
+        The ``region`` parameter selects part of the frame. It is a
+        tuple of a :py:class:`slice` of rows, the length of each row in
+        bytes and a :py:class:`slice` of bytes in each row. Only the
+        selected bytes are read, and they're returned as a 2-D
+        :py:class:`numpy.uint8` array.
+
+        :param int z: The frame to read.
+
+        :param tuple region: The part of the frame to read.
+
+        """
+        with self.lock:
+            self.closing = False
+            if not self.pf:
+                self.pf = open(self.path, 'rb')
+                if self.memmap:
+                    # map data area after the header
+                    self.file_data = numpy.memmap(
+                        self.pf, dtype=numpy.uint8, mode='r',
+                        offset=self.data_start,
+                        shape=(self.len_z, self.bytes_per_frame))
+            self.users += 1
+        try:
+            if region is None:
+                if self.memmap:
+                    return self.file_data[z]
+                return os.pread(self.pf.fileno(), self.bytes_per_frame,
+                                self.data_start + (z * self.bytes_per_frame))
+            rows, row_bytes, span = region
+            if self.memmap:
+                return self.file_data[z].reshape(-1, row_bytes)[rows, span]
+            rows = range(*rows.indices(self.bytes_per_frame // row_bytes))
+            span = range(*span.indices(row_bytes))
+            result = numpy.empty((len(rows), len(span)), dtype=numpy.uint8)
+            pos = self.data_start + (z * self.bytes_per_frame) + span.start
+            for n, row in enumerate(rows):
+                os.preadv(self.pf.fileno(), [result[n]],
+                          pos + (row * row_bytes))
+            return result
+        finally:
+            with self.lock:
+                self.users -= 1
+                if self.closing and not self.users:
+                    self._close()
+
+    def close(self):
+        """Close the file when it's not being read (thread-safe)."""
+        with self.lock:
+            self.closing = True
+            if not self.users:
+                self._close()
+
+    def _close(self):
+        self.closing = False
+        # memory mapped data stays valid while any views of it exist
+        self.file_data = None
+        if self.pf:
+            self.pf.close()
+            self.pf = None
+
+
+class FrameCache(object):
+    """Converted frames of one file, stored in :py:data:`frame_cache_dir`.
+
+    Each frame is stored in its own ``.npy`` file, in a directory named
+    after a hash of ``key``, which should include everything that
+    affects the converted data, e.g. the source file's path, size and
+    modification time and the conversion parameters. Stored frames are
+    memory mapped when they are used.
+
+    Before a frame is stored the least recently used frames (of any
+    file) are deleted to keep the total disk space used within
+    ``budget`` bytes. Using a stored frame updates its modification
+    time.
+
+    :raises OSError: If a single frame is larger than ``budget``.
+
+    """
+    def __init__(self, key, shape, dtype, budget):
+        self.dir = os.path.join(
+            frame_cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.budget = budget
+        self.nbytes = math.prod(self.shape) * self.dtype.itemsize
+        if self.nbytes > budget:
+            raise OSError('Cache size too small for {}'.format(key))
+        self.lock = threading.Lock()
+        # estimate of total size, checked when it exceeds the budget
+        self.total = budget
+        self.pending = 0
+
+    @staticmethod
+    def trim(budget):
+        """Delete least recently used stored frames.
+
+        Sizes are the disk space allocated to each file, which may be
+        more than its length.
+
+        :param int budget: Maximum total size in bytes of the remaining
+            files.
+
+        :return: The total size of the remaining files.
+
+        :rtype: :py:class:`int`
+
+        """
+        entries = []
+        try:
+            dir_names = os.listdir(frame_cache_dir)
+        except OSError:
+            return 0
+        for dir_name in dir_names:
+            directory = os.path.join(frame_cache_dir, dir_name)
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith('.npy'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                size = getattr(stat, 'st_blocks', None)
+                if size is None:
+                    size = stat.st_size
+                else:
+                    size *= 512
+                entries.append((stat.st_mtime_ns, size, path))
+        entries.sort()
+        total = sum(x[1] for x in entries)
+        for mtime, size, path in entries:
+            if total <= budget:
+                break
+            logger.debug('Deleting cache file %s', path)
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            try:
+                # only succeeds if the directory is empty
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        return total
+
+    def frame_path(self, z):
+        return os.path.join(self.dir, '{:06d}.npy'.format(z))
+
+    def get(self, z):
+        """Get a stored frame.
+
+        :return: A read-only view of the frame, or :py:data:`None` if
+            it's not been stored.
+
+        """
+        path = self.frame_path(z)
+        try:
+            data = numpy.load(path, mmap_mode='r')
+            if data.shape != self.shape or data.dtype != self.dtype:
+                return None
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def store(self, z, fill):
+        """Store a frame.
+
+        The frame is converted directly into a new file with a unique
+        name, which is then renamed, in case another process is storing
+        the same frame.
+
+        :param int z: The frame number.
+
+        :param callable fill: Function to convert the frame, with an
+            ``out`` parameter for the array to convert into.
+
+        :return: A read-only view of the stored frame, or
+            :py:data:`None` if it can't be stored.
+
+        """
+        with self.lock:
+            if self.total + self.nbytes > self.budget:
+                # free some extra space, so the directory isn't scanned
+                # for every frame, and allow for frames being stored by
+                # other threads
+                self.total = self.pending + self.trim(
+                    self.budget - self.pending
+                    - max(self.nbytes, self.budget // 16))
+            self.total += self.nbytes
+            self.pending += self.nbytes
+        try:
+            return self._store(z, fill)
+        finally:
+            with self.lock:
+                self.pending -= self.nbytes
+
+    def _store(self, z, fill):
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.dir)
+            os.close(fd)
+        except OSError as ex:
+            logger.warning('Cannot store frame %d: %s', z, str(ex))
+            return None
+        try:
+            data = numpy.lib.format.open_memmap(
+                tmp_path, mode='w+', dtype=self.dtype, shape=self.shape)
+            fill(out=data)
+            data.flush()
+            del data
+            os.replace(tmp_path, self.frame_path(z))
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return self.get(z)
+
+
 class KWFileReader(Component):
     """Read "Kingswood picture files".
 
     This component reads a subset of the very flexible "Kingswood
     picture file" format used from the 1980s on at BBC Research.
 
-    ===========  ====  ====
+    The ``memmap`` option maps the file's picture data into memory
+    instead of reading it. Each frame is then a view of the mapped data,
+    so no copy is made until the data is converted to floating point.
+    Several components reading the same file share the same pages of the
+    operating system's file cache.
+
+    The ``start``, ``stop`` and ``step`` config items select a range of
+    frames from the file, like a Python slice. A ``stop`` value of 0
+    means the end of the file. Frames outside the range are skipped
+    without being read. The :py:meth:`seek` method can be used (e.g. by
+    an interactive viewer) to jump to any frame in the range.
+
+    Setting ``prefetch`` to a non-zero value reads and converts that
+    many frames ahead of the current one, using a pool of ``threads``
+    background threads. This keeps the rest of the pipeline busy when
+    the file is on a slow (e.g. network) drive. Changes to the frame
+    range config only take effect after the prefetched frames have been
+    output.
+
+    Integer sample data is normally converted to floating point, with
+    the file's precision scaling removed and an offset of 128 added to
+    Y & RGB data. Setting ``output_dtype`` to ``'int'`` outputs the
+    file's signed integer samples instead, without scaling or offset.
+    These are a view of the file data if possible. The conversion to
+    floating point is done in place in the output array, without
+    temporary arrays, and the output arrays are reused once all other
+    references to them have been released.
+
+    A sequence of files can be read as if it was one file by setting
+    ``paths`` to a comma separated list of file names or glob patterns.
+    Numbered files matching a pattern are read in numerical order. The
+    files' headers must be compatible, i.e. have the same dimensions and
+    data type. Output frame numbers increase continuously through the
+    sequence, and the ``start``, ``stop`` and ``step`` config items and
+    :py:meth:`seek` method use frame numbers in the whole sequence. With
+    ``prefetch`` set each file is opened, and its first frames read,
+    before the previous file has finished.
+
+    The ``crop`` config reads part of each picture. It can be the
+    ``'active'`` area given in the file header, or a width and height
+    (e.g. ``'720x576'``) with an optional horizontal and vertical offset
+    (e.g. ``'720x576+16+0'``). The window is centred if no offset is
+    given. The ``decimate`` config subsamples the (cropped) picture, for
+    quick previews of large files. No filtering is done. Only the rows
+    and columns needed are read and converted, so the time to read a
+    frame depends on the output size rather than the file's picture
+    size.
+
+    If ``fields`` is set, and the file header's ``interlace`` value is
+    not zero, each frame is output as two fields of half the height, in
+    the order set by ``topfirst``. The fields are views of the frame's
+    data, so no data is copied. The output frame numbers count fields,
+    i.e. they increase at twice the frame rate, and each field's
+    ``'field'`` metadata is set to ``'top'`` or ``'bottom'``. Its
+    ``'field_freq'`` metadata is set to the header's field rate. A
+    cropped picture's fields are still the original file's fields, but
+    ``decimate`` must be odd.
+
+    The time taken to read and convert each frame, the number of bytes
+    read, and the time spent waiting for prefetched frames are added up
+    and can be got with the :py:meth:`stats` method. They are logged
+    (at ``INFO`` level) when the component stops. If ``timing`` is set
+    each frame's values are also added to its metadata, with tags
+    ``'read_time'``, ``'convert_time'``, ``'bytes_read'``,
+    ``'queue_wait'`` and ``'cached'`` (see below).
+
+    If ``cache`` is set, floating point output frames are stored in
+    memory mapped files in :py:data:`frame_cache_dir` as they are
+    converted, one file per frame. Reading the same file again (with
+    the same ``crop`` and ``decimate`` settings) outputs read-only views
+    of the stored frames without reading or converting the original
+    data. Stored frames are discarded if the file is changed. The least
+    recently used stored frames are deleted to keep the disk space they
+    use within ``cache_size`` MiB, so a few frames of a very large file
+    can still be cached.
+
+    Samples can be 1, 2, 3 or 4 byte signed integers, 4 byte floats, or
+    "bit pipe" data. Bit pipe samples have ``8 + over_bits + acc_bits``
+    bits, packed with no unused bits, most significant bit first in big
+    endian (``PIC-PIPE``) files and least significant bit first in
+    little endian (``PIC-pipe``) files.
+
+    ================  ====  ====
     Config
-    ===========  ====  ====
-    ``path``     str   Path name of file to be read.
-    ``noaudit``  bool  Don't output file's "audit trail" metadata.
-    ===========  ====  ====
+    ================  ====  ====
+    ``path``          str   Path name of file to be read.
+    ``paths``         str   Glob pattern(s) or list of files to read instead of ``path``.
+    ``noaudit``       bool  Don't output file's "audit trail" metadata.
+    ``memmap``        bool  Use a memory mapped file instead of reading data.
+    ``start``         int   First frame to read.
+    ``stop``          int   Frame after the last one to read. 0 reads to end of file.
+    ``step``          int   Frame increment, e.g. 2 to read every other frame.
+    ``looping``       str   Whether to play continuously. Can be ``'off'``, ``'repeat'`` or ``'reverse'``.
+    ``prefetch``      int   Number of frames to read ahead. 0 disables background reading.
+    ``threads``       int   Number of background reading threads.
+    ``output_dtype``  str   Output data type. Can be ``'float'`` or ``'int'``.
+    ``crop``          str   Part of picture to read, e.g. ``'720x576'``, ``'720x576+16+0'`` or ``'active'``.
+    ``decimate``      int   Spatial subsampling factor, e.g. 2 to read every other row & column.
+    ``fields``        bool  Output each field of interlaced files separately.
+    ``topfirst``      bool  Top field first.
+    ``timing``        bool  Add reading statistics to each frame's metadata.
+    ``cache``         bool  Store converted frames for future use.
+    ``cache_size``    int   Maximum total size (MiB) of stored frames.
+    ================  ====  ====
 
     """
 
@@ -81,93 +695,238 @@ class KWFileReader(Component):
 
     def initialise(self):
         self.config['path'] = ConfigPath()
+        self.config['paths'] = ConfigStr()
         self.config['noaudit'] = ConfigBool()
+        self.config['memmap'] = ConfigBool()
+        self.config['start'] = ConfigInt(min_value=0)
+        self.config['stop'] = ConfigInt(min_value=0)
+        self.config['step'] = ConfigInt(value=1, min_value=1)
+        self.config['looping'] = ConfigEnum(choices=('off', 'repeat', 'reverse'))
+        self.config['prefetch'] = ConfigInt(min_value=0)
+        self.config['threads'] = ConfigInt(value=1, min_value=1)
+        self.config['output_dtype'] = ConfigEnum(choices=('float', 'int'))
+        self.config['crop'] = ConfigStr()
+        self.config['decimate'] = ConfigInt(value=1, min_value=1)
+        self.config['fields'] = ConfigBool()
+        self.config['topfirst'] = ConfigBool(value=True)
+        self.config['timing'] = ConfigBool()
+        self.config['cache'] = ConfigBool()
+        self.config['cache_size'] = ConfigInt(value=4096, min_value=0)
+        self.seek_frame = None
+        self.stats_lock = threading.Lock()
+        self.frame_stats = dict.fromkeys((
+            'frames', 'cached', 'bytes_read', 'read_time', 'convert_time',
+            'queue_wait'), 0)
+        self.generator = None
 
     def on_start(self):
         # create file reader
+        if self.generator:
+            self.generator.close()
         self.frame_no = 0
+        with self.stats_lock:
+            self.frame_stats = dict.fromkeys(self.frame_stats, 0)
         self.generator = self.file_reader()
 
+    def on_stop(self):
+        # stop any background reading and close file
+        if self.generator:
+            self.generator.close()
+            self.generator = None
+        self.logger.info(
+            '%(frames)d frames (%(cached)d cached), %(bytes_read)d bytes,'
+            ' read %(read_time).3fs,'
+            ' convert %(convert_time).3fs, wait %(queue_wait).3fs',
+            self.stats())
+
+    def stats(self):
+        """Thread-safe method to get reading statistics.
+
+        The statistics are totals since the component was started. Times
+        are in seconds. ``'read_time'`` and ``'convert_time'`` may add
+        up to more than the elapsed time if ``threads`` is greater than
+        1. With ``memmap`` set most of the file reading happens during
+        conversion, as the data is only read when it's accessed.
+        ``'queue_wait'`` is the time spent waiting for prefetched frames
+        to be read. It is zero if ``prefetch`` is not set.
+
+        :return: Number of frames read, number of those got from the
+            ``cache``, and totals of ``'bytes_read'``, ``'read_time'``,
+            ``'convert_time'`` and ``'queue_wait'``.
+
+        :rtype: :py:class:`dict`
+
+        """
+        with self.stats_lock:
+            return dict(self.frame_stats)
+
     def process_frame(self):
         frame = self.outframe_pool['output'].get()
-        frame.data = next(self.generator)
-        frame.metadata.copy(self.metadata)
+        frame.data, data_file, field, timing = next(self.generator)
+        frame.metadata.copy(data_file.metadata)
+        if field:
+            frame.metadata.set('field', field)
+            frame.metadata.set('field_freq', str(self.field_freq))
+        if self.config['timing']:
+            for key, value in timing.items():
+                frame.metadata.set(key, str(value))
         frame.frame_no = self.frame_no
         self.frame_no += 1
-        frame.type = self.frame_type
+        frame.type = data_file.frame_type
         self.send('output', frame)
 
+    def seek(self, frame_no):
+        """Thread-safe method to jump to a frame of the file.
+
+        The next frame output will be file frame ``frame_no``, limited
+        to the ``start`` and ``stop`` range. Reading then continues from
+        there with the current ``step`` and ``looping`` settings.
+
+        :param int frame_no: The file frame to read next.
+
+        """
+        self.seek_frame = frame_no
+
+    def file_list(self):
+        paths = self.config['paths']
+        if not paths:
+            return [self.config['path']]
+        result = []
+        for pattern in paths.split(','):
+            pattern = os.path.expanduser(pattern.strip())
+            matches = glob.glob(pattern)
+            if not matches:
+                self.logger.warning('No files match "%s"', pattern)
+            # sort numbered files into numerical order
+            result += sorted(matches, key=lambda x: [
+                int(y) if y.isdigit() else y for y in re.split(r'(\d+)', x)])
+        return result
+
+    def crop_window(self, header):
+        crop = self.config['crop'].strip()
+        if not crop:
+            return 0, 0, header.len_x, header.len_y
+        if crop == 'active':
+            width = min(header.active_width or header.len_x, header.len_x)
+            height = min(header.active_height or header.len_y, header.len_y)
+            x0, y0 = None, None
+        else:
+            match = re.match(r'(\d+)x(\d+)(?:\+(\d+)\+(\d+))?$', crop)
+            if not match:
+                raise ValueError('Unrecognised crop "{}"'.format(crop))
+            width, height = int(match.group(1)), int(match.group(2))
+            x0, y0 = match.group(3), match.group(4)
+        if x0 is None:
+            # centre the window
+            x0 = (header.len_x - width) // 2
+            y0 = (header.len_y - height) // 2
+        else:
+            x0, y0 = int(x0), int(y0)
+        if (min(x0, y0, width - 1, height - 1) < 0
+                or x0 + width > header.len_x or y0 + height > header.len_y):
+            raise ValueError('Crop {}x{}+{}+{} is outside {}x{} picture'.format(
+                width, height, x0, y0, header.len_x, header.len_y))
+        return x0, y0, width, height
+
     def file_reader(self):
         self.update_config()
-        path = self.config['path']
-        # open file
-        with open(path, 'rb') as pf:
-            # read header
-            preamble = pf.read(1)
-            if preamble[0] == 16:
-                # KW picture file
-                big_endian = False
-                header, audit_lines = self.read_kw_header(pf)
-                shape = header.len_y, header.len_x, header.comps
-                swap_axes = False
-            else:
-                preamble += pf.read(7)
-                if preamble == b'PIC-PIPE':
-                    # big endian pic pipe
-                    big_endian = True
-                elif preamble == b'PIC-pipe':
-                    # small endian pic pipe
-                    big_endian = False
-                else:
-                    print('Unrecognised header', preamble)
-                    return
-                # read header
-                count = int.from_bytes(
-                    pf.read(4), byteorder=('little', 'big')[big_endian],
-                    signed=True)
-                pf.read(4)
-                header_struct = struct.Struct(
-                    ('<', '>')[big_endian] + PicFile_fmt)
-                header = PicFile(*header_struct.unpack(pf.read(count - 4)))
-                header = header._replace(
-                    pic_name=header.pic_name.decode('ascii').strip('\0'),
-                    code=header.code.decode('ascii').strip('\0'),
-                    data_type=DataTypes(header.data_type))
-                shape = header.len_y, header.comps, header.len_x
-                swap_axes = True
-                # read audit trail
-                audit_lines = []
-                while True:
-                    count = int.from_bytes(
-                        pf.read(4), byteorder=('little', 'big')[big_endian],
-                        signed=True)
-                    if count == 0:
-                        break
-                    audit_lines.append(pf.read(80)[:count].decode('ascii'))
-            print(header)
-            if header.interleave != 1:
-                print('Cannot read interleave', header.interleave)
+        paths = self.file_list()
+        if not paths:
+            self.logger.critical('No files to read')
+            return
+        # read headers
+        with ThreadPoolExecutor(max_workers=self.config['threads']) as pool:
+            futures = [pool.submit(probe, path) for path in paths]
+        infos = []
+        for path, future in zip(paths, futures):
+            try:
+                infos.append(future.result())
+            except (OSError, ValueError) as ex:
+                self.logger.critical('%s: %s', path, str(ex))
                 return
-            if header.data_type == DataTypes.ps_tng_KW:
-                bytes_per_sample = (((header.over_bits + 7) // 8)
-                                    + 1 + ((header.acc_bits + 7) // 8))
-            elif header.data_type == DataTypes.ps_tng_BYTE:
-                bytes_per_sample = 1
-            elif header.data_type == DataTypes.ps_tng_SHORT:
-                bytes_per_sample = 2
-            elif header.data_type == DataTypes.ps_tng_REAL:
-                bytes_per_sample = 4
-            else:
-                print('Cannot read', header.data_type.name)
+        info = infos[0]
+        header = info.header
+        big_endian = info.format == 'PIC-PIPE'
+        if info.format == 'KW':
+            shape = header.len_y, header.len_x, header.comps
+            swap_axes = False
+        else:
+            shape = header.len_y, header.comps, header.len_x
+            swap_axes = True
+        self.logger.debug('%s: %s', paths[0], header)
+        if header.interleave != 1:
+            self.logger.critical('Cannot read interleave %d', header.interleave)
+            return
+        if header.data_type == DataTypes.ps_tng_KW:
+            bits_per_sample = 8 * (((header.over_bits + 7) // 8)
+                                   + 1 + ((header.acc_bits + 7) // 8))
+        elif header.data_type == DataTypes.ps_tng_BITPIPE:
+            bits_per_sample = 8 + header.over_bits + header.acc_bits
+        elif header.data_type == DataTypes.ps_tng_BYTE:
+            bits_per_sample = 8
+        elif header.data_type == DataTypes.ps_tng_SHORT:
+            bits_per_sample = 16
+        else:
+            bits_per_sample = 32
+        # choose numpy data type and unpacking function
+        unpack = None
+        if header.data_type == DataTypes.ps_tng_REAL:
+            dtype = ('<f4', '>f4')[big_endian]
+        elif header.data_type == DataTypes.ps_tng_BITPIPE:
+            if not 1 < bits_per_sample <= 32:
+                self.logger.critical(
+                    'Cannot read %d bit samples', bits_per_sample)
+                return
+            dtype = numpy.int32
+            unpack = partial(unpack_bits, bits=bits_per_sample,
+                             big_endian=big_endian)
+        elif bits_per_sample == 8:
+            dtype = 'i1'
+        elif bits_per_sample == 16:
+            dtype = ('<i2', '>i2')[big_endian]
+        elif bits_per_sample == 24:
+            dtype = numpy.int32
+            unpack = partial(unpack_int24, big_endian=big_endian)
+        elif bits_per_sample == 32:
+            dtype = ('<i4', '>i4')[big_endian]
+        else:
+            self.logger.critical('Cannot read %d bit samples', bits_per_sample)
+            return
+        samples = header.len_y * header.len_x * header.comps
+        bytes_per_frame = ((samples * bits_per_sample) + 7) // 8
+        # check the files are compatible and get their lengths
+        compatible_fields = ('comps', 'interleave', 'len_x', 'len_y',
+                             'acc_bits', 'over_bits', 'data_type',
+                             'precision')
+        files = []
+        starts = []
+        len_z = 0
+        for path, info in zip(paths, infos):
+            if info.format != infos[0].format or any(
+                    getattr(info.header, x) != getattr(header, x)
+                    for x in compatible_fields):
+                self.logger.critical(
+                    'File %s does not match %s', path, paths[0])
                 return
-            self.frame_type = header.code
-            self.metadata = Metadata()
+            file_len_z = min(
+                info.header.len_z,
+                (os.path.getsize(path) - info.data_start) // bytes_per_frame)
+            if file_len_z < 1:
+                self.logger.warning('No frames in file %s', path)
+                continue
+            files.append(DataFile(path, info.data_start, file_len_z,
+                                  bytes_per_frame, self.config['memmap']))
+            starts.append(len_z)
+            len_z += file_len_z
+            # make metadata
+            files[-1].frame_type = info.header.code
+            files[-1].metadata = Metadata()
             if self.config['noaudit']:
                 audit = ''
             else:
                 audit = '{} = '.format(os.path.basename(path))
                 indent = 0
-                for line in audit_lines:
+                for line in info.audit:
                     if line[0] == '{':
                         indent += 1
                     if audit[-1] == '\n':
@@ -177,120 +936,267 @@ class KWFileReader(Component):
                         indent -= 1
             audit += 'data = KWFileReader({})\n'.format(os.path.basename(path))
             audit += self.config.audit_string()
-            self.metadata.set('audit', audit)
-            # read data
-            bytes_per_frame = (header.len_y * header.len_x
-                               * header.comps * bytes_per_sample)
-            for z in range(header.len_z):
-                raw_data = pf.read(bytes_per_frame)
-                # convert to numpy array
-                if header.data_type == DataTypes.ps_tng_REAL:
-                    dtype = ('<f4', '>f4')[big_endian]
-                elif bytes_per_sample == 1:
-                    dtype = 'i1'
-                elif bytes_per_sample == 2:
-                    dtype = ('<i2', '>i2')[big_endian]
+            files[-1].metadata.set('audit', audit)
+        if len_z < 1:
+            self.logger.critical('No frames to read')
+            return
+        # select part of the picture to read
+        try:
+            x0, y0, width, height = self.crop_window(header)
+        except ValueError as ex:
+            self.logger.critical(str(ex))
+            return
+        step = self.config['decimate']
+        out_shape = -(-height // step), -(-width // step), header.comps
+        row_samples = header.len_x * header.comps
+        if swap_axes:
+            span = slice(x0, ((header.comps - 1) * header.len_x) + x0 + width)
+        else:
+            span = slice(x0 * header.comps, (x0 + width) * header.comps)
+        # select field rows
+        fields = None
+        if self.config['fields']:
+            if not header.interlace:
+                self.logger.warning('File is not interlaced')
+            elif step % 2 == 0:
+                self.logger.critical(
+                    'Cannot decimate fields by %d', step)
+                return
+            else:
+                # first output row may be in the bottom field
+                fields = [('top', y0 % 2), ('bottom', 1 - (y0 % 2))]
+                if not self.config['topfirst']:
+                    fields.reverse()
+                self.field_freq = header.field_freq
+        if out_shape == (header.len_y, header.len_x, header.comps):
+            region = None
+        elif header.data_type == DataTypes.ps_tng_BITPIPE:
+            # rows may not start on a byte boundary, so read a band of
+            # whole rows starting on a sample group boundary
+            group = 8 // math.gcd(bits_per_sample, 8)
+            first = ((y0 * row_samples) // group) * group
+            band = slice(y0 * row_samples - first,
+                         (y0 + height) * row_samples - first)
+            region = (slice(0, 1), bytes_per_frame,
+                      slice((first * bits_per_sample) // 8,
+                            -(-((first + band.stop) * bits_per_sample) // 8)))
+            samples = band.stop
+        else:
+            # read the selected samples of each selected row
+            region = (slice(y0, y0 + height, step),
+                      (row_samples * bits_per_sample) // 8,
+                      slice((span.start * bits_per_sample) // 8,
+                            (span.stop * bits_per_sample) // 8))
+            samples = out_shape[0] * (span.stop - span.start)
+        # set conversion parameters
+        if (self.config['output_dtype'] == 'int'
+                and header.data_type != DataTypes.ps_tng_REAL):
+            out_dtype = numpy.dtype(dtype).newbyteorder('=')
+            scale = 1.0
+            offset = 0
+        else:
+            out_dtype = pt_float
+            scale = pt_float(2 ** -header.precision)
+            if header.comps != 2:
+                # Y & RGB have 128 offset
+                offset = pt_float(128.0)
+            else:
+                offset = 0
+        buffers = BufferPool(out_shape, out_dtype)
+        if unpack:
+            # unpacked samples, padded to a whole number of bytes
+            group = 8 // math.gcd(bits_per_sample, 8)
+            unpack_buffers = BufferPool(
+                (-(-samples // group) * group,), numpy.int32)
+
+        if self.config['cache']:
+            if out_dtype != pt_float:
+                self.logger.warning('Only floating point output is cached')
+            else:
+                budget = self.config['cache_size'] * 1024 * 1024
+                params = ([info.format, x0, y0, width, height, step,
+                           float(scale), float(offset)]
+                          + [getattr(header, x) for x in compatible_fields])
+                for data_file in files:
+                    stat = os.stat(data_file.path)
+                    key = repr([os.path.realpath(data_file.path),
+                                stat.st_mtime_ns, stat.st_size,
+                                data_file.data_start] + params)
+                    try:
+                        data_file.cache = FrameCache(
+                            key, out_shape, out_dtype, budget)
+                    except OSError as ex:
+                        self.logger.warning('Cannot cache %s: %s',
+                                            data_file.path, str(ex))
+
+        def read_frame(file_frame):
+            # can be called from any thread
+            idx = bisect.bisect_right(starts, file_frame) - 1
+            data_file = files[idx]
+            z = file_frame - starts[idx]
+            cache = data_file.cache
+            start = time.perf_counter()
+            if cache:
+                data = cache.get(z)
+                if data is not None:
+                    timing = {'read_time': time.perf_counter() - start,
+                              'convert_time': 0.0, 'bytes_read': 0,
+                              'cached': 1}
+                    return data, data_file, timing
+            raw_data = data_file.read(z, region)
+            read_done = time.perf_counter()
+            data = None
+            if cache:
+                data = cache.store(z, partial(convert, raw_data))
+            if data is None:
+                data = convert(raw_data)
+            timing = {'read_time': read_done - start,
+                      'convert_time': time.perf_counter() - read_done,
+                      'bytes_read': memoryview(raw_data).nbytes,
+                      'cached': 0}
+            return data, data_file, timing
+
+        def convert(raw_data, out=None):
+            # convert to numpy array
+            if region is None:
+                if unpack:
+                    data = unpack(raw_data, out=unpack_buffers.get())
+                    data = data[:samples].reshape(shape)
                 else:
-                    print('Cannot read', bytes_per_sample, 'byte samples')
-                    return
-                data = numpy.ndarray(shape=shape, dtype=dtype, buffer=raw_data)
+                    data = numpy.ndarray(
+                        shape=shape, dtype=dtype, buffer=raw_data)
                 if swap_axes:
                     # pic pipe data is in (y, c, x) order
                     data = numpy.swapaxes(data, 1, 2)
-                if header.precision > 0:
-                    data = (data.astype(pt_float)
-                            / pt_float(2 ** header.precision))
-                if header.comps != 2:
-                    # Y & RGB have 128 offset
-                    data = data.astype(pt_float) + pt_float(128.0)
-                yield data
-            
-    def read_kw_header(self, pf):
-        audit = []
-        header = {'data_type': DataTypes.ps_tng_KW, 'precision': 0}
+            else:
+                data = select(raw_data)
+            if out_dtype != pt_float and data.dtype.isnative:
+                # no conversion needed
+                return data
+            # convert without temporaries, into a recycled buffer or the
+            # cache
+            if out is None:
+                out = buffers.get()
+            if scale != 1.0:
+                numpy.multiply(data, scale, out=out, dtype=out_dtype)
+                if offset:
+                    out += offset
+            elif offset:
+                numpy.add(data, offset, out=out, dtype=out_dtype)
+            else:
+                numpy.copyto(out, data)
+            return out
+
+        def select(raw_data):
+            # convert part of a frame to a (y, x, c) array view
+            if header.data_type == DataTypes.ps_tng_BITPIPE:
+                data = unpack(raw_data, out=unpack_buffers.get())
+                data = data[band].reshape(height, row_samples)[::step, span]
+            elif unpack:
+                data = unpack(numpy.ascontiguousarray(raw_data),
+                              out=unpack_buffers.get())
+                data = data[:samples].reshape(out_shape[0], -1)
+            else:
+                data = raw_data.view(dtype)
+            if swap_axes:
+                # pic pipe data is in (y, c, x) order
+                data = numpy.lib.stride_tricks.as_strided(
+                    data, shape=(data.shape[0], header.comps, width),
+                    strides=(data.strides[0], header.len_x * data.strides[1],
+                             data.strides[1]), writeable=False)
+                return numpy.swapaxes(data[:, :, ::step], 1, 2)
+            return data.reshape(data.shape[0], width, header.comps)[:, ::step]
+
+        current = None
+        try:
+            with closing(self.read_frames(read_frame, len_z)) as frames:
+                for data, data_file, timing in frames:
+                    if data_file is not current:
+                        # finished with previous file
+                        if current:
+                            current.close()
+                        current = data_file
+                    with self.stats_lock:
+                        self.frame_stats['frames'] += 1
+                        for key, value in timing.items():
+                            self.frame_stats[key] += value
+                    if not fields:
+                        yield data, data_file, None, timing
+                        continue
+                    # output views of each field's rows
+                    for field, first_row in fields:
+                        yield data[first_row::2], data_file, field, timing
+        finally:
+            for data_file in files:
+                data_file.close()
+                data_file.cache = None
+
+    def read_frames(self, read_frame, len_z):
+        prefetch = self.config['prefetch']
+        if not prefetch:
+            for file_frame, jump in self.frame_sequence(len_z):
+                data, data_file, timing = read_frame(file_frame)
+                timing['queue_wait'] = 0.0
+                yield data, data_file, timing
+            return
+
+        def next_frame():
+            # get oldest prefetched frame, timing the wait for it
+            start = time.perf_counter()
+            data, data_file, timing = pending.popleft().result()
+            timing['queue_wait'] = time.perf_counter() - start
+            return data, data_file, timing
+
+        # read frames in a pool of background threads
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.config['threads']) as pool:
+            try:
+                for file_frame, jump in self.frame_sequence(len_z):
+                    if jump:
+                        # discard frames read before seek
+                        while pending:
+                            pending.popleft().cancel()
+                    pending.append(pool.submit(read_frame, file_frame))
+                    if len(pending) > prefetch:
+                        yield next_frame()
+                while pending:
+                    yield next_frame()
+            finally:
+                while pending:
+                    pending.popleft().cancel()
+
+    def frame_sequence(self, len_z):
+        # generate (file_frame, jump) pairs from current config
+        file_frame = None
+        direction = 1
         while True:
-            tag1 = pf.read(1)[0]
-            if tag1 == 24:
-                # two-byte integer value
-                tag2 = pf.read(1)[0]
-                count = pf.read(1)[0]
-                if (tag2, count) == (33, 1):
-                    pf.read(2)
-                elif (tag2, count) == (34, 2):
-                    header['comps'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['interleave'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                elif (tag2, count) == (35, 1):
-                    header['chroma_phase'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                elif (tag2, count) == (36, 4):
-                    header['full_width'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['full_height'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['field_freq'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['interlace'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                elif (tag2, count) == (37, 4):
-                    header['active_width'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['active_height'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['aspect_width'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['aspect_height'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                elif (tag2, count) == (38, 2):
-                    header['over_bits'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['acc_bits'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                elif (tag2, count) == (39, 4):
-                    header['min_lum'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['max_lum'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['min_chrom'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['max_chrom'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                elif (tag2, count) == (40, 3):
-                    header['pos_x'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['pos_y'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['pos_z'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                elif (tag2, count) == (41, 3):
-                    header['len_x'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['len_y'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                    header['len_z'] = int.from_bytes(
-                        pf.read(2), byteorder='little', signed=True)
-                else:
-                    print('Unrecognised KW int code', tag2, 'or count', count)
-                    pf.read(count * 2)
-            elif tag1 == 28:
-                # string value
-                tag2 = pf.read(1)[0]
-                count = pf.read(1)[0]
-                if tag2 == 97:
-                    audit.append(pf.read(count).decode('ascii'))
-                elif tag2 == 98:
-                    header['pic_name'] = pf.read(count).decode('ascii')
-                elif tag2 == 99:
-                    header['code'] = pf.read(count).decode('ascii')
-                else:
-                    print('Unrecognised KW string code', tag2)
-                    pf.read(count)
-            elif tag1 == 32:
-                # end of header
-                break
+            self.update_config()
+            start = self.config['start']
+            stop = min(self.config['stop'] or len_z, len_z)
+            step = self.config['step']
+            looping = self.config['looping']
+            if start >= stop:
+                self.logger.critical('No frames in range %d-%d', start, stop)
+                return
+            seek_frame, self.seek_frame = self.seek_frame, None
+            if seek_frame is not None:
+                file_frame = max(min(seek_frame, stop - 1), start)
+                yield file_frame, True
+                continue
+            if file_frame is None:
+                file_frame = start
             else:
-                print('Unrecognised KW tag', tag1)
-        header['precision'] = ((header['acc_bits'] + 7) // 8) * 8
-        header = PicFile(**header)
-        return header, audit
+                file_frame += step * direction
+                if not start <= file_frame < stop:
+                    if looping == 'off':
+                        return
+                    last = start + (((stop - 1 - start) // step) * step)
+                    if looping == 'repeat':
+                        file_frame = start
+                    elif file_frame >= stop:
+                        file_frame = max(last - step, start)
+                        direction = -1
+                    else:
+                        file_frame = min(start + step, last)
+                        direction = 1
+            yield file_frame, False
@@ -0,0 +1,279 @@
+#  Pyctools - a picture processing algorithm development kit.
+#  http://github.com/jim-easterbrook/pyctools
+#  Copyright (C) 2020  Jim Easterbrook
+#
+#  This program is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see
+#  <http://www.gnu.org/licenses/>.
+
+__all__ = ['KWFileWriter']
+__docformat__ = 'restructuredtext en'
+
+import math
+import os
+import struct
+
+import numpy
+
+from pyctools.core.config import ConfigEnum, ConfigInt, ConfigPath
+from pyctools.core.base import Component
+from pyctools.core.frame import Metadata
+from pyctools.core.types import pt_float
+from .kwfilereader import DataTypes, PicFile, PicFile_fmt
+
+
+class KWFileWriter(Component):
+    """Write "Kingswood picture files".
+
+    This component writes files that can be read by
+    :py:class:`~.kwfilereader.KWFileReader`. The ``format`` config
+    selects a KW tag header or a little (``'PIC-pipe'``) or big
+    (``'PIC-PIPE'``) endian pic-pipe header. KW files can't store
+    ``'REAL'`` data.
+
+    Data is converted to the file's sample type in the reverse of the
+    way :py:class:`~.kwfilereader.KWFileReader` converts it, i.e. the
+    128 offset is removed from Y & RGB data and ``'SHORT'`` samples have
+    8 bits of fractional precision. The input frames' audit trail is
+    stored in the file header.
+
+    If the number of frames to be written is known, setting ``frames``
+    allows the file to be allocated in advance and memory mapped. Each
+    frame is then converted directly into the file's pages. Otherwise
+    each frame is written with a single large write. In either case the
+    header's frame count is corrected when the component stops.
+
+    =============  ===  ====
+    Config
+    =============  ===  ====
+    ``path``       str  Path name of file to be written.
+    ``format``     str  Header format. Can be ``'KW'``, ``'PIC-pipe'`` or ``'PIC-PIPE'``.
+    ``data_type``  str  Sample type. Can be ``'BYTE'``, ``'SHORT'`` or ``'REAL'``.
+    ``frames``     int  Number of frames to be written, if known.
+    =============  ===  ====
+
+    """
+
+    with_outframe_pool = False
+    inputs = ['input']  #:
+    outputs = []
+
+    def initialise(self):
+        self.config['path'] = ConfigPath(exists=False)
+        self.config['format'] = ConfigEnum(
+            choices=('KW', 'PIC-pipe', 'PIC-PIPE'))
+        self.config['data_type'] = ConfigEnum(
+            choices=('BYTE', 'SHORT', 'REAL'))
+        self.config['frames'] = ConfigInt(min_value=0)
+        self.generator = None
+
+    def on_start(self):
+        # start generator to write data
+        self.generator = self.file_writer()
+        next(self.generator)
+
+    def on_stop(self):
+        # finish writing file
+        if self.generator:
+            self.generator.close()
+            self.generator = None
+
+    def process_frame(self):
+        self.generator.send(self.input_buffer['input'].get())
+
+    def file_writer(self):
+        self.update_config()
+        path = self.config['path']
+        fmt = self.config['format']
+        frames = self.config['frames']
+        data_type = DataTypes['ps_tng_' + self.config['data_type']]
+        big_endian = fmt == 'PIC-PIPE'
+        if fmt == 'KW' and data_type == DataTypes.ps_tng_REAL:
+            self.logger.critical('Cannot store REAL data in KW file')
+            return
+        # get first frame
+        frame = yield True
+        data = frame.as_numpy(dtype=pt_float)
+        ylen, xlen, comps = data.shape
+        # set conversion parameters
+        if data_type == DataTypes.ps_tng_REAL:
+            dtype = ('<f4', '>f4')[big_endian]
+            precision = 0
+        elif data_type == DataTypes.ps_tng_SHORT:
+            dtype = ('<i2', '>i2')[big_endian]
+            precision = 8
+        else:
+            dtype = 'i1'
+            precision = 0
+        dtype = numpy.dtype(dtype)
+        if comps != 2:
+            # Y & RGB have 128 offset
+            offset = pt_float(128.0)
+        else:
+            offset = pt_float(0.0)
+        scale = pt_float(2 ** precision)
+        if fmt == 'KW':
+            file_shape = ylen, xlen, comps
+        else:
+            # pic pipe data is in (y, c, x) order
+            file_shape = ylen, comps, xlen
+        bytes_per_frame = ylen * xlen * comps * dtype.itemsize
+        # make header
+        aspect = math.gcd(xlen, ylen)
+        header = PicFile(
+            comps=comps, interleave=1, chroma_phase=0,
+            full_width=xlen, full_height=ylen, field_freq=50, interlace=0,
+            active_width=xlen, active_height=ylen,
+            aspect_width=xlen // aspect, aspect_height=ylen // aspect,
+            acc_bits=precision, over_bits=0,
+            min_lum=16, max_lum=235, min_chrom=16, max_chrom=240,
+            pos_x=0, pos_y=0, pos_z=0, len_x=xlen, len_y=ylen, len_z=frames,
+            pic_name=os.path.basename(path), code=frame.type,
+            data_type=data_type, precision=precision)
+        metadata = Metadata().copy(frame.metadata)
+        metadata.set_audit(
+            self, '{} = data\n'.format(os.path.basename(path)),
+            with_date=True, with_config=self.config)
+        audit_lines = [x for x in metadata.get('audit').splitlines()
+                       if x.strip()]
+        with open(path, 'w+b') as pf:
+            # write header
+            if fmt == 'KW':
+                len_z_pos = self.write_kw_header(pf, header, audit_lines)
+            else:
+                len_z_pos = self.write_pic_pipe_header(
+                    pf, header, audit_lines, big_endian)
+            data_start = pf.tell()
+            if frames:
+                # allocate and map whole file
+                pf.truncate(data_start + (frames * bytes_per_frame))
+                file_data = numpy.memmap(
+                    pf, dtype=dtype, mode='r+', offset=data_start,
+                    shape=(frames,) + file_shape)
+            else:
+                file_data = None
+            out_buffer = numpy.empty(file_shape, dtype=dtype)
+            if data_type != DataTypes.ps_tng_REAL:
+                float_buffer = numpy.empty(data.shape, dtype=pt_float)
+                limits = numpy.iinfo(dtype)
+            z = 0
+            try:
+                while True:
+                    if file_data is not None and z >= frames:
+                        # more frames than expected
+                        self.logger.warning(
+                            'More than %d frames, file not mapped', frames)
+                        file_data.flush()
+                        file_data = None
+                        pf.seek(data_start + (z * bytes_per_frame))
+                    if file_data is None:
+                        out = out_buffer
+                    else:
+                        out = file_data[z]
+                    if fmt == 'KW':
+                        out_view = out
+                    else:
+                        out_view = numpy.swapaxes(out, 1, 2)
+                    # convert data
+                    if data_type == DataTypes.ps_tng_REAL:
+                        numpy.subtract(data, offset, out=out_view)
+                    else:
+                        numpy.subtract(data, offset, out=float_buffer)
+                        if scale != 1.0:
+                            float_buffer *= scale
+                        numpy.rint(float_buffer, out=float_buffer)
+                        numpy.clip(float_buffer, limits.min, limits.max,
+                                   out=float_buffer)
+                        numpy.copyto(out_view, float_buffer, casting='unsafe')
+                    if file_data is None:
+                        pf.write(out)
+                    z += 1
+                    # get next frame
+                    frame = yield True
+                    data = frame.as_numpy(dtype=pt_float)
+                    if data.shape != (ylen, xlen, comps):
+                        self.logger.critical('Image dimensions changed')
+                        return
+            finally:
+                if file_data is not None:
+                    file_data.flush()
+                    file_data = None
+                    if z < frames:
+                        pf.truncate(data_start + (z * bytes_per_frame))
+                if z != frames:
+                    # correct header's frame count
+                    pf.seek(len_z_pos)
+                    if fmt == 'KW':
+                        pf.write(struct.pack('<h', z))
+                    else:
+                        pf.write(struct.pack(('<i', '>i')[big_endian], z))
+
+    @staticmethod
+    def write_kw_header(pf, header, audit):
+        def int_tag(tag2, *values):
+            pf.write(struct.pack('<BBB', 24, tag2, len(values)))
+            pf.write(struct.pack('<{}h'.format(len(values)), *values))
+
+        def str_tag(tag2, value):
+            value = value.encode('ascii')
+            while True:
+                pf.write(struct.pack('<BBB', 28, tag2, len(value[:255])))
+                pf.write(value[:255])
+                value = value[255:]
+                if not value:
+                    break
+
+        pf.write(bytes([16]))
+        int_tag(34, header.comps, header.interleave)
+        int_tag(35, header.chroma_phase)
+        int_tag(36, header.full_width, header.full_height,
+                header.field_freq, header.interlace)
+        int_tag(37, header.active_width, header.active_height,
+                header.aspect_width, header.aspect_height)
+        int_tag(38, header.over_bits, header.acc_bits)
+        int_tag(39, header.min_lum, header.max_lum,
+                header.min_chrom, header.max_chrom)
+        int_tag(40, header.pos_x, header.pos_y, header.pos_z)
+        # len_z is last value of tag
+        int_tag(41, header.len_x, header.len_y, header.len_z)
+        len_z_pos = pf.tell() - 2
+        for line in audit:
+            str_tag(97, line)
+        str_tag(98, header.pic_name)
+        str_tag(99, header.code)
+        pf.write(bytes([32]))
+        return len_z_pos
+
+    @staticmethod
+    def write_pic_pipe_header(pf, header, audit, big_endian):
+        endian = ('<', '>')[big_endian]
+        header_struct = struct.Struct(endian + PicFile_fmt)
+        pf.write((b'PIC-pipe', b'PIC-PIPE')[big_endian])
+        pf.write(struct.pack(endian + 'i', header_struct.size + 4))
+        pf.write(bytes(4))
+        header_pos = pf.tell()
+        pf.write(header_struct.pack(*header._replace(
+            pic_name=header.pic_name.encode('ascii'),
+            code=header.code.encode('ascii'),
+            data_type=header.data_type.value)))
+        # write audit trail in 80 character chunks
+        for line in audit:
+            line = line.encode('ascii')
+            while True:
+                pf.write(struct.pack(endian + 'i', len(line[:80])))
+                pf.write(line[:80].ljust(80, b'\0'))
+                line = line[80:]
+                if not line:
+                    break
+        pf.write(struct.pack(endian + 'i', 0))
+        return header_pos + (PicFile._fields.index('len_z') * 4)
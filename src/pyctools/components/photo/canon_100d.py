@@ -17,18 +17,28 @@
 #  along with this program.  If not, see
 #  <http://www.gnu.org/licenses/>.
 
-__all__ = ['CanonGamma']
+__all__ = ['CanonGamma', 'CanonGammaInverse']
 __docformat__ = 'restructuredtext en'
 
 import numpy
 
-from pyctools.components.colourspace.gammacorrection import PiecewiseGammaCorrect
+from .gammalut import LUTGammaCorrect
+
+in_vals = '0,  5, 10, 15, 20, 30, 40, 60, 90,130,170,210,250,270'
+out_vals = '0, 30, 56, 80, 99,126,147,176,204,226,240,250,256,257'
 
 def CanonGamma(config={}, **kwds):
     """Gamma correction function reverse engineered from a Canon EOS
-    100D camera. See also
-    pyctools.components.colourspace.gammacorrection.PiecewiseGammaCorrect"""
-    return PiecewiseGammaCorrect(
-        in_vals= '0,  5, 10, 15, 20, 30, 40, 60, 90,130,170,210,250,270',
-        out_vals='0, 30, 56, 80, 99,126,147,176,204,226,240,250,256,257',
+    100D camera. Set the ``lut`` config to use a look up table. See also
+    pyctools.components.photo.gammalut.LUTGammaCorrect"""
+    return LUTGammaCorrect(
+        in_vals=in_vals, out_vals=out_vals,
         smooth=True, config=config, **kwds)
+
+def CanonGammaInverse(config={}, **kwds):
+    """Inverse of CanonGamma, to convert camera JPEG images to linear
+    light. The inverse function is computed numerically and stored as
+    look up tables that are reused in later sessions."""
+    return LUTGammaCorrect(
+        in_vals=in_vals, out_vals=out_vals,
+        smooth=True, inverse=True, lut=True, config=config, **kwds)
@@ -0,0 +1,263 @@
+#  Pyctools-Jim - miscellaneous pyctools components that aren't good enough
+#  for general use.
+#  http://github.com/jim-easterbrook/pyctools-jim
+#  Copyright (C) 2026  Jim Easterbrook  jim@jim-easterbrook.me.uk
+#
+#  This program is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see
+#  <http://www.gnu.org/licenses/>.
+
+__all__ = ['LUTGammaCorrect']
+__docformat__ = 'restructuredtext en'
+
+from functools import lru_cache
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy
+
+from pyctools.components.colourspace.gammacorrection import (
+    PiecewiseGammaCorrect, apply_transfer_function)
+from pyctools.core.config import ConfigBool
+from pyctools.core.types import pt_float
+
+logger = logging.getLogger(__name__)
+
+#: Number of entries in the table used for floating point data.
+float_table_size = 65536
+
+#: Directory where tables are stored for future use. Set to
+#: :py:data:`None` to disable.
+table_dir = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'pyctools-jim', 'gamma')
+
+
+def stored_table(name, key, build):
+    """Get a table from :py:data:`table_dir`, or build and store it.
+
+    :param str name: Type of table, used as the file name prefix.
+
+    :param bytes key: Data that determines the table's contents, e.g.
+        the transfer function values.
+
+    :param callable build: Function to compute the table if it's not
+        been stored.
+
+    :rtype: :py:class:`numpy.ndarray`
+
+    """
+    if not table_dir:
+        return build()
+    path = os.path.join(table_dir, '{}-{}.npy'.format(
+        name, hashlib.sha1(key).hexdigest()))
+    try:
+        return numpy.load(path)
+    except (OSError, ValueError):
+        pass
+    table = build()
+    tmp_path = None
+    try:
+        os.makedirs(table_dir, exist_ok=True)
+        # use a unique name in case another process is storing the table
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=table_dir)
+        with os.fdopen(fd, 'wb') as f:
+            numpy.save(f, table)
+        os.replace(tmp_path, path)
+    except OSError as ex:
+        logger.warning('Cannot store table %s: %s', path, str(ex))
+        if tmp_path:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+    return table
+
+
+def invert(in_vals, out_vals):
+    """Invert a monotonic transfer function.
+
+    The inverse function's input values (i.e. ``out_vals``) are made
+    strictly increasing by removing any points where the function is
+    not, so small errors (e.g. from curve smoothing) don't stop the
+    function being inverted.
+
+    :param numpy.ndarray in_vals: Transfer function input values.
+
+    :param numpy.ndarray out_vals: Transfer function output values.
+
+    :return: Input and output values of the inverse function.
+
+    :rtype: (:py:class:`numpy.ndarray`, :py:class:`numpy.ndarray`)
+
+    """
+    keep = out_vals > numpy.maximum.accumulate(
+        numpy.concatenate(([-numpy.inf], out_vals[:-1])))
+    if not keep.all():
+        logger.warning('Transfer function is not monotonic, %d points'
+                       ' ignored', numpy.count_nonzero(~keep))
+    return out_vals[keep], in_vals[keep]
+
+
+@lru_cache(maxsize=32)
+def int_table(in_vals, out_vals, dtype):
+    """Make a table of a transfer function for every integer value.
+
+    The parameters are :py:class:`bytes` (or :py:class:`str`) so that
+    results can be cached.
+
+    :param bytes in_vals: Transfer function input values.
+
+    :param bytes out_vals: Transfer function output values.
+
+    :param str dtype: The integer type, e.g. ``'|u1'`` or ``'<i2'``.
+
+    :return: A table to be indexed by the unsigned equivalent of the
+        integer values.
+
+    :rtype: :py:class:`numpy.ndarray`
+
+    """
+    dtype = numpy.dtype(dtype).newbyteorder('=')
+
+    def build():
+        index = numpy.arange(1 << (dtype.itemsize * 8)).astype(
+            numpy.dtype('u{}'.format(dtype.itemsize)))
+        # signed values are indexed by their bit pattern
+        table = index.view(dtype).astype(pt_float)
+        apply_transfer_function(
+            table.reshape(-1, 1, 1), numpy.frombuffer(in_vals, dtype=pt_float),
+            numpy.frombuffer(out_vals, dtype=pt_float))
+        return table
+
+    return stored_table(
+        'int', dtype.str.encode('ascii') + in_vals + b'/' + out_vals, build)
+
+
+@lru_cache(maxsize=32)
+def float_table(in_vals, out_vals):
+    """Make a table of a transfer function at evenly spaced values.
+
+    The table spans the range of ``in_vals`` with
+    :py:data:`float_table_size` entries.
+
+    :param bytes in_vals: Transfer function input values.
+
+    :param bytes out_vals: Transfer function output values.
+
+    :return: The first input value, the number of table entries per
+        unit input, the table values and the slope of each table
+        interval.
+
+    :rtype: (:py:class:`float`, :py:class:`float`,
+        :py:class:`numpy.ndarray`, :py:class:`numpy.ndarray`)
+
+    """
+    key = str(float_table_size).encode('ascii') + in_vals + b'/' + out_vals
+    in_vals = numpy.frombuffer(in_vals, dtype=pt_float)
+    out_vals = numpy.frombuffer(out_vals, dtype=pt_float)
+    x0, x1 = in_vals[0], in_vals[-1]
+    scale = (float_table_size - 1) / (x1 - x0)
+
+    def build():
+        table = numpy.linspace(x0, x1, float_table_size, dtype=pt_float)
+        apply_transfer_function(table.reshape(-1, 1, 1), in_vals, out_vals)
+        slope = numpy.diff(table)
+        # use exact slopes of end intervals, as they're extrapolated
+        slope[0] = (out_vals[1] - out_vals[0]) / (
+            (in_vals[1] - in_vals[0]) * scale)
+        slope[-1] = (out_vals[-1] - out_vals[-2]) / (
+            (in_vals[-1] - in_vals[-2]) * scale)
+        return numpy.stack((table[:-1], slope))
+
+    table, slope = stored_table('float', key, build)
+    return x0, scale, table, slope
+
+
+class LUTGammaCorrect(PiecewiseGammaCorrect):
+    """Piecewise gamma correction with an optional look up table.
+
+    This is a
+    :py:class:`~pyctools.components.colourspace.gammacorrection.PiecewiseGammaCorrect`
+    with an extra ``lut`` option. When set, the (smoothed) transfer
+    function is converted to a table when the config changes, instead of
+    being evaluated for every pixel.
+
+    8 and 16 bit integer input (e.g. from JPEG or raw files) is
+    converted with a table of every possible value in a single indexing
+    pass, giving the same result as normal processing. Other input is
+    converted to floating point and linearly interpolated from a table
+    of :py:data:`float_table_size` evenly spaced values, which is a very
+    close approximation. Tables are cached, so components with the same
+    config share them. They are also stored in :py:data:`table_dir`, so
+    they don't need to be computed again in future sessions.
+
+    In ``inverse`` mode the (monotonic) transfer function is inverted
+    numerically by :py:func:`invert` before the tables are made, e.g.
+    to convert camera JPEG images back to linear light.
+
+    ==============  =====  ====
+    Config
+    ==============  =====  ====
+    ``in_vals``     str    List of input values, in increasing order.
+    ``out_vals``    str    List of corresponding output values.
+    ``inverse``     bool
+    ``smooth``      bool   Smooth transform with cubic spline interpolation. Requires scipy.
+    ``lut``         bool   Use a look up table.
+    ==============  =====  ====
+
+    """
+
+    def initialise(self):
+        super(LUTGammaCorrect, self).initialise()
+        self.config['lut'] = ConfigBool()
+
+    def transform(self, in_frame, out_frame):
+        if not self.initialised:
+            self.adjust_params()
+        if not self.config['lut']:
+            return super(LUTGammaCorrect, self).transform(in_frame, out_frame)
+        inverse = self.config['inverse']
+        if inverse:
+            in_vals, out_vals = invert(self.in_vals, self.out_vals)
+        else:
+            in_vals, out_vals = self.in_vals, self.out_vals
+        in_vals = numpy.ascontiguousarray(in_vals, dtype=pt_float).tobytes()
+        out_vals = numpy.ascontiguousarray(out_vals, dtype=pt_float).tobytes()
+        data = in_frame.as_numpy()
+        if data.dtype.kind in 'iu' and data.dtype.itemsize <= 2:
+            table = int_table(in_vals, out_vals, data.dtype.str)
+            index = data.view('u{}'.format(data.dtype.itemsize))
+            out_frame.data = numpy.take(table, index)
+        else:
+            x0, scale, table, slope = float_table(in_vals, out_vals)
+            pos = numpy.subtract(data, x0, dtype=pt_float)
+            pos *= scale
+            idx = numpy.floor(pos)
+            numpy.clip(idx, 0, table.shape[0] - 1, out=idx)
+            # fractional part is not clipped, to extrapolate end intervals
+            pos -= idx
+            idx = idx.astype(numpy.intp)
+            pos *= slope[idx]
+            pos += table[idx]
+            out_frame.data = pos
+        # add audit
+        audit = out_frame.metadata.get('audit')
+        audit += 'data = {}PiecewiseGammaCorrect(data)\n'.format(
+            ('', 'Inverse ')[inverse])
+        audit += '    in_vals: {}\n'.format(self.config['in_vals'])
+        audit += '    out_vals: {}\n'.format(self.config['out_vals'])
+        out_frame.metadata.set('audit', audit)
+        return True
@@ -20,71 +20,439 @@
 __all__ = ['InferGamma']
 __docformat__ = 'restructuredtext en'
 
+from concurrent.futures import ThreadPoolExecutor
+import math
+import threading
+import time
+
 import numpy
 
+from pyctools.core.config import ConfigEnum, ConfigFloat, ConfigInt
 from pyctools.core.base import Component
 from pyctools.core.types import pt_float
 
 
+def rank_values(parts, ranks):
+    """Get values of given ranks from a set of sorted arrays.
+
+    This gives the same result as ``numpy.sort(numpy.concatenate(parts))
+    [ranks]`` without merging the arrays. The interval containing each
+    rank's value is narrowed, by interpolation or bisection, until it
+    contains only one distinct value.
+
+    :param list parts: Sorted 1-D arrays.
+
+    :param numpy.ndarray ranks: Positions in the merged sorted values.
+
+    :rtype: :py:class:`numpy.ndarray`
+
+    """
+    parts = [x for x in parts if x.shape[0]]
+    if len(parts) == 1:
+        return parts[0][ranks]
+    dtype = parts[0].dtype
+    inf = numpy.array(numpy.inf, dtype=dtype)
+    # value of rank is greater than lo and less than or equal to hi, and
+    # the parts have idx_lo values <= lo and idx_hi values <= hi
+    idx_lo = [numpy.zeros(ranks.shape, numpy.intp) for x in parts]
+    idx_hi = [numpy.full(ranks.shape, x.shape[0]) for x in parts]
+    n = 0
+    while True:
+        # get lowest and highest values in each interval
+        first = numpy.full(ranks.shape, inf)
+        last = numpy.full(ranks.shape, -inf)
+        for x, lo, hi in zip(parts, idx_lo, idx_hi):
+            numpy.minimum(first, numpy.where(
+                lo < x.shape[0], x[numpy.minimum(lo, x.shape[0] - 1)], inf),
+                out=first)
+            numpy.maximum(last, numpy.where(
+                hi > 0, x[numpy.maximum(hi - 1, 0)], -inf), out=last)
+        if numpy.array_equal(first, last):
+            return first
+        # choose a value to split at, interpolating just above and below
+        # the target rank or bisecting
+        target = (0.5, -0.5, None)[n % 3]
+        n += 1
+        if target is None:
+            alpha = 0.5
+        else:
+            count_lo = sum(idx_lo)
+            alpha = (ranks + target - count_lo) / (sum(idx_hi) - count_lo)
+        mid = (first + (alpha * (last.astype(float) - first))).astype(dtype)
+        # keep split in [first, last) so interval always gets smaller
+        numpy.minimum(mid, numpy.nextafter(last, -inf), out=mid)
+        numpy.maximum(mid, first, out=mid)
+        idx_mid = [numpy.searchsorted(x, mid, side='right') for x in parts]
+        above = sum(idx_mid) > ranks
+        for j in range(len(parts)):
+            idx_hi[j] = numpy.where(above, idx_mid[j], idx_hi[j])
+            idx_lo[j] = numpy.where(above, idx_lo[j], idx_mid[j])
+
+
+def match_levels(lin_sort, cor_sort, levels):
+    """Find the corrected values that correspond to linear levels.
+
+    Each level is found in the sorted linear values, and the corrected
+    value at the same position in the sorted corrected values is linearly
+    interpolated. If several linear values equal a level the middle one
+    is used.
+
+    The sorted values can be a list of sorted parts, e.g. from tiles of
+    a picture, as long as both inputs have the same number of values.
+    The parts are not merged.
+
+    :param numpy.ndarray lin_sort: Sorted linear values.
+
+    :param numpy.ndarray cor_sort: Sorted corrected values.
+
+    :param numpy.ndarray levels: Increasing linear levels to match.
+
+    :rtype: :py:class:`numpy.ndarray`
+
+    """
+    if isinstance(lin_sort, numpy.ndarray):
+        lin_sort = [lin_sort]
+    if isinstance(cor_sort, numpy.ndarray):
+        cor_sort = [cor_sort]
+    lin_sort = [x for x in lin_sort if x.shape[0]]
+    n = sum(x.shape[0] for x in lin_sort)
+    left = [numpy.searchsorted(x, levels, side='left') for x in lin_sort]
+    right = [numpy.searchsorted(x, levels, side='right') for x in lin_sort]
+    # lo is highest value that is lower than level
+    lo = sum(left) - 1
+    # hi is lowest value that is greater than level
+    hi = sum(right)
+    # get linear values without merging the parts
+    x_lo = numpy.full_like(levels, -numpy.inf)
+    x_hi = numpy.full_like(levels, numpy.inf)
+    for x, l, r in zip(lin_sort, left, right):
+        numpy.maximum(x_lo, numpy.where(
+            l > 0, x[numpy.maximum(l - 1, 0)], -numpy.inf), out=x_lo)
+        numpy.minimum(x_hi, numpy.where(
+            r < x.shape[0], x[numpy.minimum(r, x.shape[0] - 1)], numpy.inf),
+            out=x_hi)
+    # move to middle of multiple duplicate values
+    duplicates = hi - lo > 1
+    adj = numpy.where(duplicates, (hi - lo) // 2, 0)
+    lo += adj
+    hi -= adj
+    has_lo = lo >= 0
+    has_hi = (hi > lo) & (hi < n)
+    x_lo = numpy.where(duplicates | ~has_lo, levels, x_lo)
+    x_hi = numpy.where(duplicates | ~has_hi, levels, x_hi)
+    ranks = numpy.clip(numpy.concatenate((lo, hi)), 0, n - 1)
+    y_lo, y_hi = numpy.split(rank_values(cor_sort, ranks), 2)
+    # linear interp
+    dx = x_hi - x_lo
+    alpha = numpy.divide(levels - x_lo, dx, out=numpy.full_like(dx, 0.5),
+                         where=dx != 0)
+    return numpy.where(
+        has_lo, y_lo + numpy.where(has_hi, alpha * (y_hi - y_lo), 0), y_hi)
+
+
+def rank_bounds(lin_sort, cor_sort, levels, z=1.96):
+    """Get confidence bounds of a curve derived from a sample of values.
+
+    The rank of each level in the sampled linear values has a binomial
+    distribution. The corrected values at ``z`` standard deviations
+    either side of each level's rank give distribution free bounds, e.g.
+    approximately 95% confidence bounds for ``z=1.96``.
+
+    :param list lin_sort: Sorted linear values, or sorted parts of them.
+
+    :param list cor_sort: Sorted corrected values, or sorted parts of
+        them.
+
+    :param numpy.ndarray levels: Increasing linear levels.
+
+    :param float z: Width of the bounds, in standard deviations.
+
+    :return: Lower and upper bounds.
+
+    :rtype: (:py:class:`numpy.ndarray`, :py:class:`numpy.ndarray`)
+
+    """
+    if isinstance(lin_sort, numpy.ndarray):
+        lin_sort = [lin_sort]
+    if isinstance(cor_sort, numpy.ndarray):
+        cor_sort = [cor_sort]
+    n = sum(x.shape[0] for x in lin_sort)
+    rank = (sum(numpy.searchsorted(x, levels, side='left') for x in lin_sort)
+            + sum(numpy.searchsorted(x, levels, side='right')
+                  for x in lin_sort)) / 2
+    delta = z * numpy.sqrt(rank * (n - rank) / n)
+    ranks = numpy.concatenate((numpy.floor(rank - delta - 0.5),
+                               numpy.ceil(rank + delta - 0.5)))
+    ranks = numpy.clip(ranks, 0, n - 1).astype(numpy.intp)
+    return numpy.split(rank_values(cor_sort, ranks), 2)
+
+
+def match_histograms(lin_hist, cor_hist, levels):
+    """Find the corrected values that correspond to linear levels.
+
+    This is the histogram equivalent of :py:func:`match_levels`. The
+    histograms have one bin centred on each level. Values are assumed to
+    be evenly spread across each bin, so each histogram's cumulative
+    distribution is piecewise linear. The rank of each linear level is
+    found in the linear distribution, then the corrected value of the
+    same rank is interpolated from the corrected distribution.
+
+    :param numpy.ndarray lin_hist: Histogram of linear values.
+
+    :param numpy.ndarray cor_hist: Histogram of corrected values.
+
+    :param numpy.ndarray levels: Evenly spaced linear levels.
+
+    :rtype: :py:class:`numpy.ndarray`
+
+    """
+    step = (levels[-1] - levels[0]) / (levels.shape[0] - 1)
+    edges = numpy.append(levels - (step / 2), levels[-1] + (step / 2))
+    lin_cdf = numpy.append(0, numpy.cumsum(lin_hist)) / max(lin_hist.sum(), 1)
+    cor_cdf = numpy.append(0, numpy.cumsum(cor_hist)) / max(cor_hist.sum(), 1)
+    # rank of each level is half way through its bin
+    rank = (lin_cdf[:-1] + lin_cdf[1:]) / 2
+    return numpy.interp(rank, cor_cdf, edges).astype(pt_float)
+
+
 class InferGamma(Component):
     """Compares two inputs and derives a gamma function for each
-    component."""
+    component.
+
+    The ``linear_in`` and ``corr_in`` values are each sorted, then the
+    gamma corrected value with the same rank as each linear level is
+    found. The levels are ``levels`` evenly spaced values from ``black``
+    to ``white``, e.g. set ``levels`` to 4096 or 16384 to get the full
+    resolution of 12 or 14 bit raw data.
+
+    In ``'histogram'`` mode the inputs are not sorted. Instead a
+    histogram of each component of each input, with one bin per level,
+    is accumulated over any number of input frame pairs. This needs both
+    inputs to have values in the range ``black`` to ``white``. A gamma
+    curve is derived by matching the cumulative distributions of the
+    histograms. It is output every ``interval`` frame pairs and when the
+    component stops, or only when it stops if ``interval`` is zero. The
+    histograms are cleared if the config is changed.
+
+    Each component of each input is sorted (or counted) by a pool of
+    ``threads`` worker threads. Large pictures can also be divided into
+    ``tiles`` horizontal strips that are processed separately, so more
+    threads can be kept busy. Sorted strips are not merged, the values
+    needed from them are found by :py:func:`rank_values`, so the result
+    is the same as without tiling. This search takes longer as
+    ``levels`` increases, so tiling a sort is most useful with a small
+    number of levels and many processor cores.
+
+    For a quick estimate, set ``samples`` to use a subset of the pixels
+    instead of the whole picture. The same pixels are taken from each
+    input. In ``'random'`` sampling they are chosen at random from the
+    whole picture, in ``'stratified'`` sampling the picture is divided
+    into ``samples`` similar sized cells and one pixel is chosen at
+    random from each cell. The choice depends only on ``seed`` and the
+    picture size, so repeated runs give the same result. In ``'sort'``
+    mode the ``function`` output then has two more curves for each
+    component, giving approximate 95% confidence bounds (see
+    :py:func:`rank_bounds`). These spread out wherever too few samples
+    were found.
+
+    Processing time is logged (at ``DEBUG`` level) for each frame pair,
+    and the totals can be got with the :py:meth:`stats` method.
+
+    ============  =====  ====
+    Config
+    ============  =====  ====
+    ``method``    str    Can be ``'sort'`` or ``'histogram'``.
+    ``levels``    int    Number of points in the gamma curve.
+    ``black``     float  Lowest linear level.
+    ``white``     float  Highest linear level.
+    ``interval``  int    Number of frame pairs between ``'histogram'`` outputs.
+    ``threads``   int    Number of worker threads.
+    ``tiles``     int    Number of horizontal strips to divide each picture into.
+    ``samples``   int    Number of pixels to use. 0 uses every pixel.
+    ``sampling``  str    Pixel selection. Can be ``'random'`` or ``'stratified'``.
+    ``seed``      int    Random number generator seed.
+    ============  =====  ====
+
+    """
 
     inputs = ['corr_in', 'linear_in']
     outputs = ['function']
 
+    def initialise(self):
+        self.config['method'] = ConfigEnum(choices=('sort', 'histogram'))
+        self.config['levels'] = ConfigInt(value=256, min_value=2)
+        self.config['black'] = ConfigFloat(value=0.0, decimals=2)
+        self.config['white'] = ConfigFloat(value=255.0, decimals=2)
+        self.config['interval'] = ConfigInt(min_value=0)
+        self.config['threads'] = ConfigInt(value=1, min_value=1)
+        self.config['tiles'] = ConfigInt(value=1, min_value=1)
+        self.config['samples'] = ConfigInt(min_value=0)
+        self.config['sampling'] = ConfigEnum(choices=('random', 'stratified'))
+        self.config['seed'] = ConfigInt(min_value=0)
+        self.histograms = None
+        self.stats_lock = threading.Lock()
+        self.frame_stats = dict.fromkeys(
+            ('frames', 'pixels', 'convert_time', 'process_time'), 0)
+
+    def on_start(self):
+        with self.stats_lock:
+            self.frame_stats = dict.fromkeys(self.frame_stats, 0)
+
+    def on_stop(self):
+        # output final histogram curve, unless it's just been sent
+        if self.histograms:
+            interval = self.config['interval']
+            if not interval or self.histograms['frames'] % interval:
+                self.send_function(self.histogram_curve())
+        self.histograms = None
+        self.logger.info(
+            '%(frames)d frame pairs, convert %(convert_time).3fs,'
+            ' process %(process_time).3fs', self.stats())
+
     def process_frame(self):
+        start = time.perf_counter()
+        self.update_config()
         # get inputs
         corr_in = self.input_buffer['corr_in'].get()
         linear_in = self.input_buffer['linear_in'].get()
         cor_data = corr_in.as_numpy(dtype=pt_float)
         lin_data = linear_in.as_numpy(dtype=pt_float)
+        levels = numpy.linspace(
+            self.config['black'], self.config['white'],
+            self.config['levels'], dtype=pt_float)
         h, w, comps = cor_data.shape
-        func_data = [numpy.arange(256, dtype=pt_float)]
-        for comp in range(comps):
-            # sort data
-            cor_sort = numpy.sort(cor_data[:,:,comp], axis=None)
-            lin_sort = numpy.sort(lin_data[:,:,comp], axis=None)
+        samples = self.config['samples']
+        subsampled = 0 < samples < h * w
+        if subsampled:
+            ys, xs = self.sample_positions(h, w, samples)
+            cor_data = cor_data[ys, xs][:, numpy.newaxis]
+            lin_data = lin_data[ys, xs][:, numpy.newaxis]
+        convert_done = time.perf_counter()
+        tiles = self.config['tiles']
+        with ThreadPoolExecutor(max_workers=self.config['threads']) as pool:
+            if self.config['method'] == 'histogram':
+                self.accumulate(pool, tiles, cor_data, lin_data, levels)
+                interval = self.config['interval']
+                if interval and self.histograms['frames'] % interval == 0:
+                    self.send_function(self.histogram_curve())
+            else:
+                self.send_function(*self.sort_curve(
+                    pool, tiles, cor_data, lin_data, levels, subsampled))
+        end = time.perf_counter()
+        self.logger.debug('frame %d: convert %.3fs, process %.3fs',
+                          linear_in.frame_no, convert_done - start,
+                          end - convert_done)
+        with self.stats_lock:
+            self.frame_stats['frames'] += 1
+            self.frame_stats['pixels'] += cor_data.shape[0] * cor_data.shape[1]
+            self.frame_stats['convert_time'] += convert_done - start
+            self.frame_stats['process_time'] += end - convert_done
+
+    def stats(self):
+        """Thread-safe method to get processing statistics.
+
+        The statistics are totals since the component was started. Times
+        are in seconds.
+
+        :return: Number of frame pairs and pixels processed, and
+            totals of ``'convert_time'`` (getting the inputs as
+            floating point and subsampling them) and ``'process_time'``
+            (sorting or counting them and computing the gamma curve).
+
+        :rtype: :py:class:`dict`
+
+        """
+        with self.stats_lock:
+            return dict(self.frame_stats)
+
+    def sample_positions(self, h, w, samples):
+        rng = numpy.random.default_rng(self.config['seed'])
+        if self.config['sampling'] == 'random':
+            idx = rng.choice(h * w, samples, replace=False, shuffle=False)
+            idx.sort()
+            return numpy.divmod(idx, w)
+        # one pixel from each cell of a grid
+        ny = min(max(int(round(math.sqrt(samples * h / w))), 1), h)
+        nx = min(max(samples // ny, 1), w)
+        ys = (numpy.arange(ny)[:, numpy.newaxis]
+              + rng.random((ny, nx))) * (h / ny)
+        xs = (numpy.arange(nx)[numpy.newaxis, :]
+              + rng.random((ny, nx))) * (w / nx)
+        return (numpy.minimum(ys.astype(numpy.intp), h - 1).ravel(),
+                numpy.minimum(xs.astype(numpy.intp), w - 1).ravel())
+
+    def sort_curve(self, pool, tiles, cor_data, lin_data, levels, bounds):
+        h, w, comps = cor_data.shape
+        # sort each tile of each component
+        parts = {}
+        for name, data in (('cor', cor_data), ('lin', lin_data)):
+            for comp in range(comps):
+                parts[name, comp] = [
+                    pool.submit(numpy.sort, tile, axis=None)
+                    for tile in numpy.array_split(data[:, :, comp], tiles)]
+        for key in parts:
+            parts[key] = [x.result() for x in parts[key]]
+
+        def match(comp):
             # find corresponding values
-            y_value = numpy.empty_like(func_data[0])
-            idx = 0
-            for i in range(func_data[0].shape[0]):
-                while idx < lin_sort.shape[0] and lin_sort[idx] < func_data[0][i]:
-                    idx += 1
-                lo = idx - 1
-                hi = idx
-                while hi < lin_sort.shape[0] and lin_sort[hi] <= func_data[0][i]:
-                    hi += 1
-                # lo points to highest value that is lower than target
-                # hi points to lowest value that is greater than target
-                if hi - lo > 1:
-                    # move to middle of multiple duplicate values
-                    adj = (hi - lo) // 2
-                    lo += adj
-                    hi -= adj
-                x_points = []
-                y_points = []
-                if lo >= 0:
-                    x_points.append(lin_sort[lo])
-                    y_points.append(cor_sort[lo])
-                if hi > lo and hi < lin_sort.shape[0]:
-                    x_points.append(lin_sort[hi])
-                    y_points.append(cor_sort[hi])
-                y_value[i] = y_points[0]
-                if len(x_points) == 2:
-                    # linear interp
-                    if x_points[1] == x_points[0]:
-                        alpha = 0.5
-                    else:
-                        alpha = ((func_data[0][i] - x_points[0]) /
-                                     (x_points[1] - x_points[0]))
-                    y_value[i] += alpha * (y_points[1] - y_points[0])
-                print(x_points[0], y_points[0])
-            func_data.append(y_value)
+            return match_levels(parts['lin', comp], parts['cor', comp], levels)
+
+        def confidence(comp):
+            return rank_bounds(parts['lin', comp], parts['cor', comp], levels)
+
+        func_data = [levels] + list(pool.map(match, range(comps)))
+        labels = ['gamma curve', 'R', 'G', 'B']
+        if bounds:
+            names = labels[1:] + [str(x) for x in range(3, comps)]
+            for comp, (low, high) in enumerate(
+                    pool.map(confidence, range(comps))):
+                func_data += [low, high]
+                labels += [names[comp] + ' low', names[comp] + ' high']
+        return func_data, labels
+
+    def accumulate(self, pool, tiles, cor_data, lin_data, levels):
+        h, w, comps = cor_data.shape
+        key = levels[0], levels[-1], levels.shape[0], comps
+        if not self.histograms or self.histograms['key'] != key:
+            # start new histograms
+            self.histograms = {
+                'key': key, 'levels': levels, 'frames': 0,
+                'cor': numpy.zeros((comps, levels.shape[0]), numpy.int64),
+                'lin': numpy.zeros((comps, levels.shape[0]), numpy.int64)}
+        scale = (levels.shape[0] - 1) / (levels[-1] - levels[0])
+
+        def count(data):
+            # convert values to bin numbers
+            bins = numpy.subtract(data, levels[0], dtype=pt_float)
+            bins *= scale
+            numpy.rint(bins, out=bins)
+            numpy.clip(bins, 0, levels.shape[0] - 1, out=bins)
+            return numpy.bincount(
+                bins.astype(numpy.intp).ravel(), minlength=levels.shape[0])
+
+        # count each tile of each component
+        counts = []
+        for name, data in (('cor', cor_data), ('lin', lin_data)):
+            for comp in range(comps):
+                for tile in numpy.array_split(data[:, :, comp], tiles):
+                    counts.append((name, comp, pool.submit(count, tile)))
+        for name, comp, result in counts:
+            self.histograms[name][comp] += result.result()
+        self.histograms['frames'] += 1
+
+    def histogram_curve(self):
+        levels = self.histograms['levels']
+        func_data = [levels]
+        for lin_hist, cor_hist in zip(
+                self.histograms['lin'], self.histograms['cor']):
+            func_data.append(match_histograms(lin_hist, cor_hist, levels))
+        return func_data
+
+    def send_function(self, func_data, labels=None):
         # send to function output
         func_frame = self.outframe_pool['function'].get()
         func_frame.data = numpy.stack(func_data)
         func_frame.type = 'func'
         func_frame.metadata.set(
-            'labels', str(['gamma curve', 'R', 'G', 'B']))
+            'labels', str(labels or ['gamma curve', 'R', 'G', 'B']))
         self.send('function', func_frame)
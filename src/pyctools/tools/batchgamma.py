@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#  Pyctools-Jim - miscellaneous pyctools components that aren't good enough
+#  for general use.
+#  http://github.com/jim-easterbrook/pyctools-jim
+#  Copyright (C) 2026  Jim Easterbrook  jim@jim-easterbrook.me.uk
+#
+#  This program is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see
+#  <http://www.gnu.org/licenses/>.
+
+"""Infer camera gamma curves from raw and JPEG image pairs.
+
+Each raw file is compared with the camera's JPEG image of the same
+shot, as in scripts/infer_gamma.py but without a GUI. Pairs are
+processed by a pool of worker processes, one pair per worker, and the
+gamma curves are written to a CSV or NPZ file.
+
+"""
+
+import argparse
+import ast
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import logging
+import os
+import sys
+
+import numpy
+
+from pyctools.core.compound import Compound
+from pyctools.components.io.imagefilepil import ImageFileReaderPIL
+from pyctools.components.io.rawimagefilereader import RawImageFileReader
+from pyctools.components.photo.infergamma import InferGamma
+
+logger = logging.getLogger(__name__)
+
+jpeg_exts = ('.JPG', '.jpg', '.JPEG', '.jpeg')
+
+
+def find_pair(arg):
+    """Get the raw and JPEG file names from a command argument.
+
+    :param str arg: A raw file name, or a raw and a JPEG file name
+        separated by a comma. If no JPEG file is given, one with the
+        same name as the raw file is used.
+
+    :rtype: (:py:class:`str`, :py:class:`str`)
+
+    """
+    if ',' in arg:
+        raw_path, jpeg_path = arg.split(',', 1)
+        return raw_path, jpeg_path
+    root = os.path.splitext(arg)[0]
+    for ext in jpeg_exts:
+        if os.path.exists(root + ext):
+            return arg, root + ext
+    raise ValueError('No JPEG file for {}'.format(arg))
+
+
+def infer_pair(raw_path, jpeg_path, raw_config={}, gamma_config={}):
+    """Compute the gamma curve of one raw and JPEG file pair.
+
+    This is run in a worker process. The network is the same as
+    scripts/infer_gamma.py's, without the plotting components.
+
+    :return: The function data, with one row of linear levels and one
+        row of corrected values for each colour (plus confidence
+        bounds if InferGamma is subsampling), and the row labels.
+
+    :rtype: (:py:class:`numpy.ndarray`, :py:class:`list` of :py:class:`str`)
+
+    """
+    result = []
+    comp = Compound(
+        rifr=RawImageFileReader(config=dict(raw_config, path=raw_path)),
+        ifrpil=ImageFileReaderPIL(config={'path': jpeg_path}),
+        ig=InferGamma(config=gamma_config),
+        linkages={
+            ('ifrpil', 'output'): [('ig', 'corr_in')],
+            ('rifr', 'output'): [('ig', 'linear_in')],
+            ('ig', 'function'): [('self', 'function')],
+            })
+
+    def store(frame):
+        if frame:
+            result.append(frame)
+
+    comp.connect_to('function', store)
+    comp.start()
+    comp.join()
+    if not result:
+        raise RuntimeError('No gamma curve from {} and {}'.format(
+            raw_path, jpeg_path))
+    frame = result[-1]
+    labels = ast.literal_eval(frame.metadata.get('labels'))
+    return frame.as_numpy(), ['linear'] + labels[1:]
+
+
+def write_csv(path, results):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        header = None
+        for (raw_path, jpeg_path), (data, labels) in results:
+            if labels != header:
+                header = labels
+                writer.writerow(['raw', 'jpeg'] + labels)
+            for row in data.T:
+                writer.writerow([raw_path, jpeg_path] + list(row))
+
+
+def write_npz(path, results):
+    # each pair is stored as "name", "name_labels" and "name_files"
+    arrays = {}
+    for (raw_path, jpeg_path), (data, labels) in results:
+        name = os.path.splitext(os.path.basename(raw_path))[0]
+        key, n = name, 1
+        while key in arrays:
+            n += 1
+            key = '{}_{}'.format(name, n)
+        arrays[key] = data
+        arrays[key + '_labels'] = numpy.array(labels)
+        arrays[key + '_files'] = numpy.array([raw_path, jpeg_path])
+    numpy.savez(path, **arrays)
+
+
+def main():
+    # get command args
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='+', metavar='raw[,jpeg]',
+                        help='raw file and optional JPEG file')
+    parser.add_argument('-o', '--output', metavar='path', required=True,
+                        help='output file, ending .csv or .npz')
+    parser.add_argument('-j', '--jobs', type=int, metavar='n',
+                        help='number of worker processes')
+    parser.add_argument('-r', '--raw-config', default='{}', metavar='dict',
+                        help='RawImageFileReader config, e.g.'
+                        ' "{\'16bit\': True}"')
+    parser.add_argument('-g', '--gamma-config', default='{}', metavar='dict',
+                        help='InferGamma config, e.g. "{\'levels\': 4096}"')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase verbosity of log messages')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING - (args.verbose * 10))
+    fmt = os.path.splitext(args.output)[1].lower()
+    if fmt not in ('.csv', '.npz'):
+        parser.error('output file must end .csv or .npz')
+    raw_config = ast.literal_eval(args.raw_config)
+    gamma_config = ast.literal_eval(args.gamma_config)
+    pairs = []
+    for arg in args.files:
+        try:
+            pairs.append(find_pair(arg))
+        except ValueError as ex:
+            logger.error(str(ex))
+    results = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(infer_pair, raw_path, jpeg_path,
+                               raw_config, gamma_config)
+                   for raw_path, jpeg_path in pairs]
+        for pair, future in zip(pairs, futures):
+            try:
+                results.append((pair, future.result()))
+            except Exception as ex:
+                logger.error('%s: %s', pair[0], str(ex))
+                continue
+            logger.info('%s: done', pair[0])
+    if results:
+        if fmt == '.csv':
+            write_csv(args.output, results)
+        else:
+            write_npz(args.output, results)
+    return int(len(results) != len(args.files))
+
+if __name__ == '__main__':
+    sys.exit(main())
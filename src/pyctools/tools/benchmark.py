@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+#  Pyctools-Jim - miscellaneous pyctools components that aren't good enough
+#  for general use.
+#  http://github.com/jim-easterbrook/pyctools-jim
+#  Copyright (C) 2026  Jim Easterbrook  jim@jim-easterbrook.me.uk
+#
+#  This program is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see
+#  <http://www.gnu.org/licenses/>.
+
+"""Benchmark KWFileReader, InferGamma and CanonGamma.
+
+Synthetic KW and pic-pipe files of every data type are written to a
+temporary directory and read with KWFileReader, giving frames/s and MB/s
+for each. InferGamma and CanonGamma are timed on synthetic images of
+each size and bit depth. The results are written as JSON, which can be
+compared with a previous run's results.
+
+"""
+
+import argparse
+from importlib import metadata
+import json
+import logging
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import numpy
+
+from pyctools.components.io.kwfilereader import DataTypes, KWFileReader, PicFile
+from pyctools.components.io.kwfilewriter import KWFileWriter
+from pyctools.components.photo.canon_100d import CanonGamma
+from pyctools.components.photo.infergamma import InferGamma
+from pyctools.core.frame import Frame
+
+logger = logging.getLogger(__name__)
+
+#: File types to benchmark. Each is (format, data type, bits per sample).
+file_types = (
+    ('KW', 'KW', 8), ('KW', 'KW', 16), ('KW', 'KW', 24), ('KW', 'KW', 32),
+    ('PIC-pipe', 'BYTE', 8), ('PIC-pipe', 'SHORT', 16),
+    ('PIC-pipe', 'INT', 32), ('PIC-pipe', 'REAL', 32),
+    ('PIC-pipe', 'BITPIPE', 10), ('PIC-pipe', 'BITPIPE', 12),
+    ('PIC-PIPE', 'SHORT', 16), ('PIC-PIPE', 'INT', 32),
+    ('PIC-PIPE', 'REAL', 32), ('PIC-PIPE', 'BITPIPE', 10),
+    )
+
+#: Picture sizes to benchmark.
+sizes = ((720, 576), (1920, 1080), (3840, 2160))
+
+#: Image data types to benchmark gamma components with.
+image_dtypes = ('uint8', 'uint16', 'float32')
+
+
+def write_test_file(path, fmt, data_type, bits, xlen, ylen, frames,
+                    comps=3, seed=0):
+    """Write a KW or pic-pipe file of random picture data.
+
+    :param str path: Path name of file to be written.
+
+    :param str fmt: Header format. Can be ``'KW'``, ``'PIC-pipe'`` or
+        ``'PIC-PIPE'``.
+
+    :param str data_type: Sample type. Can be ``'KW'`` (for KW files),
+        ``'BYTE'``, ``'SHORT'``, ``'INT'``, ``'REAL'`` or ``'BITPIPE'``.
+
+    :param int bits: Bits per sample. KW files can have 8, 16, 24 or 32
+        bits, bit pipe files can have 8 to 32 bits.
+
+    :param int xlen: Picture width.
+
+    :param int ylen: Picture height.
+
+    :param int frames: Number of frames.
+
+    :param int comps: Number of components per pixel.
+
+    :param int seed: Random number generator seed.
+
+    :return: The number of bytes per frame.
+
+    :rtype: int
+
+    """
+    big_endian = fmt == 'PIC-PIPE'
+    data_type = DataTypes['ps_tng_' + data_type]
+    if data_type == DataTypes.ps_tng_KW:
+        # no fractional bits for 8 bit samples
+        acc_bits = max(bits - 16, 0)
+        over_bits = bits - 8 - acc_bits
+    elif data_type == DataTypes.ps_tng_REAL:
+        acc_bits = 0
+        over_bits = 0
+    else:
+        acc_bits = bits - 8
+        over_bits = 0
+    aspect = math.gcd(xlen, ylen)
+    header = PicFile(
+        comps=comps, interleave=1, chroma_phase=0,
+        full_width=xlen, full_height=ylen, field_freq=50, interlace=0,
+        active_width=xlen, active_height=ylen,
+        aspect_width=xlen // aspect, aspect_height=ylen // aspect,
+        acc_bits=acc_bits, over_bits=over_bits,
+        min_lum=16, max_lum=235, min_chrom=16, max_chrom=240,
+        pos_x=0, pos_y=0, pos_z=0, len_x=xlen, len_y=ylen, len_z=frames,
+        pic_name=os.path.basename(path), code='RGB',
+        data_type=data_type, precision=acc_bits)
+    audit = ['benchmark test file']
+    bytes_per_frame = ((xlen * ylen * comps * bits) + 7) // 8
+    rng = numpy.random.default_rng(seed)
+    with open(path, 'wb') as pf:
+        if fmt == 'KW':
+            KWFileWriter.write_kw_header(pf, header, audit)
+        else:
+            KWFileWriter.write_pic_pipe_header(pf, header, audit, big_endian)
+        for z in range(frames):
+            if data_type == DataTypes.ps_tng_REAL:
+                data = rng.uniform(-128.0, 128.0, xlen * ylen * comps)
+                pf.write(data.astype(('<f4', '>f4')[big_endian]).tobytes())
+            else:
+                # any bit pattern is a valid integer sample
+                pf.write(rng.bytes(bytes_per_frame))
+    return bytes_per_frame
+
+
+def time_reader(path, frames, **config):
+    """Time reading a file with :py:class:`KWFileReader`.
+
+    :return: The time in seconds to read ``frames`` frames.
+
+    :rtype: float
+
+    """
+    count = [0]
+
+    def sink(frame):
+        if frame is not None:
+            count[0] += 1
+
+    reader = KWFileReader(path=path, **config)
+    reader.connect_to('output', sink)
+    start = time.perf_counter()
+    reader.start()
+    reader.join()
+    elapsed = time.perf_counter() - start
+    if count[0] != frames:
+        raise RuntimeError('Read {} frames from {}, expected {}'.format(
+            count[0], path, frames))
+    return elapsed
+
+
+def bench_reader(directory, frames, repeats, sizes, file_types):
+    """Measure :py:class:`KWFileReader` throughput.
+
+    Each file is read once before timing, so results measure the speed
+    of reading from the operating system's file cache rather than the
+    disk.
+
+    """
+    results = []
+    for xlen, ylen in sizes:
+        for fmt, data_type, bits in file_types:
+            path = os.path.join(directory, 'bench_{}_{}_{}.pic'.format(
+                fmt, data_type, bits))
+            bytes_per_frame = write_test_file(
+                path, fmt, data_type, bits, xlen, ylen, frames)
+            for memmap in (False, True):
+                for output_dtype in ('float', 'int'):
+                    if output_dtype == 'int' and data_type == 'REAL':
+                        continue
+                    config = {'memmap': memmap, 'output_dtype': output_dtype}
+                    time_reader(path, frames, **config)
+                    elapsed = min(time_reader(path, frames, **config)
+                                  for i in range(repeats))
+                    result = {
+                        'benchmark': 'KWFileReader',
+                        'format': fmt, 'data_type': data_type, 'bits': bits,
+                        'size': '{}x{}'.format(xlen, ylen),
+                        'memmap': memmap, 'output_dtype': output_dtype,
+                        'frames_per_sec': frames / elapsed,
+                        'mb_per_sec': frames * bytes_per_frame / (
+                            elapsed * 1.0e6),
+                        }
+                    logger.info('%s', result)
+                    results.append(result)
+            os.unlink(path)
+    return results
+
+
+def white_level(dtype):
+    dtype = numpy.dtype(dtype)
+    if dtype.kind == 'f':
+        return 255.0
+    return float(numpy.iinfo(dtype).max)
+
+
+def make_image(dtype, xlen, ylen, seed=0):
+    rng = numpy.random.default_rng(seed)
+    return rng.uniform(0.0, white_level(dtype), (ylen, xlen, 3)).astype(dtype)
+
+
+def time_component(component, inputs, output, repeats):
+    """Measure the latency of a component.
+
+    Each repeat sends one frame to each of the component's ``inputs``
+    and waits until a frame is output.
+
+    :param component: The component to time.
+
+    :param dict inputs: Image data for each input.
+
+    :param str output: The output to wait for.
+
+    :param int repeats: Number of times to process the inputs.
+
+    :return: The latency of each repeat, in seconds.
+
+    :rtype: list(float)
+
+    """
+    done = threading.Event()
+
+    def sink(frame):
+        if frame is not None:
+            done.set()
+
+    component.connect_to(output, sink)
+    component.start()
+    latency = []
+    try:
+        for frame_no in range(repeats):
+            done.clear()
+            start = time.perf_counter()
+            for name, data in inputs.items():
+                frame = Frame()
+                frame.data = data
+                frame.type = 'RGB'
+                frame.frame_no = frame_no
+                getattr(component, name)(frame)
+            if not done.wait(timeout=600):
+                raise RuntimeError('No output from {}'.format(
+                    component.__class__.__name__))
+            latency.append(time.perf_counter() - start)
+    finally:
+        component.stop()
+        component.join()
+    return latency
+
+
+def latency_result(name, dtype, xlen, ylen, latency, **params):
+    result = {'benchmark': name, 'dtype': dtype,
+              'size': '{}x{}'.format(xlen, ylen)}
+    result.update(params)
+    result.update({'latency_min': min(latency),
+                   'latency_median': statistics.median(latency),
+                   'pixels_per_sec': xlen * ylen / min(latency)})
+    logger.info('%s', result)
+    return result
+
+
+def bench_gamma(repeats, sizes, dtypes):
+    """Measure :py:class:`InferGamma` and :py:class:`CanonGamma`
+    latency."""
+    results = []
+    for xlen, ylen in sizes:
+        for dtype in dtypes:
+            data = make_image(dtype, xlen, ylen)
+            for lut in (False, True):
+                # first frame makes and caches the look up tables
+                latency = time_component(CanonGamma(lut=lut),
+                                         {'input': data}, 'output',
+                                         repeats + 1)[1:]
+                results.append(latency_result(
+                    'CanonGamma', dtype, xlen, ylen, latency, lut=lut))
+            corr = make_image(dtype, xlen, ylen, seed=1)
+            for method in ('sort', 'histogram'):
+                latency = time_component(
+                    InferGamma(method=method, interval=1,
+                               white=white_level(dtype)),
+                    {'linear_in': data, 'corr_in': corr}, 'function',
+                    repeats)
+                results.append(latency_result(
+                    'InferGamma', dtype, xlen, ylen, latency, method=method))
+    return results
+
+
+def result_key(result):
+    return tuple((k, v) for (k, v) in sorted(result.items())
+                 if not isinstance(v, float))
+
+
+def compare(results, old_results, file=sys.stdout):
+    """Print the ratio of each result to a matching previous result."""
+    old = {result_key(x): x for x in old_results}
+    for result in results:
+        key = result_key(result)
+        if key not in old:
+            continue
+        for name in ('frames_per_sec', 'pixels_per_sec'):
+            if name in result:
+                ratio = result[name] / old[key][name]
+                print('{:6.2f} {}'.format(ratio, ' '.join(
+                    '{}={}'.format(k, v) for (k, v) in key)), file=file)
+
+
+def environment():
+    versions = {'python': platform.python_version(),
+                'numpy': numpy.__version__}
+    for package in ('pyctools.core', 'pyctools.jim'):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'versions': versions}
+
+
+def main():
+    # get command args
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-o', '--output', metavar='path',
+                        help='JSON results file (default stdout)')
+    parser.add_argument('-c', '--compare', metavar='path',
+                        help='previous JSON results file to compare with')
+    parser.add_argument('-d', '--directory', metavar='path',
+                        help='directory for test files (default temporary)')
+    parser.add_argument('-f', '--frames', type=int, default=10, metavar='n',
+                        help='number of frames in each test file')
+    parser.add_argument('-r', '--repeats', type=int, default=3, metavar='n',
+                        help='number of times to repeat each measurement')
+    parser.add_argument('-s', '--sizes', metavar='WxH,...',
+                        default=','.join('{}x{}'.format(*x) for x in sizes),
+                        help='picture sizes to test')
+    parser.add_argument('-b', '--benchmarks', metavar='name,...',
+                        default='reader,gamma',
+                        help='benchmarks to run (default "reader,gamma")')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase verbosity of log messages')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING - (args.verbose * 10))
+    test_sizes = [tuple(int(y) for y in x.split('x'))
+                  for x in args.sizes.split(',')]
+    benchmarks = args.benchmarks.split(',')
+    results = []
+    if 'reader' in benchmarks:
+        if args.directory:
+            results += bench_reader(args.directory, args.frames,
+                                    args.repeats, test_sizes, file_types)
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                results += bench_reader(directory, args.frames,
+                                        args.repeats, test_sizes, file_types)
+    if 'gamma' in benchmarks:
+        results += bench_gamma(args.repeats, test_sizes, image_dtypes)
+    output = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'],
+                    file=(sys.stderr, sys.stdout)[bool(args.output)])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
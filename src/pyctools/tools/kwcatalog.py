@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#  Pyctools-Jim - miscellaneous pyctools components that aren't good enough
+#  for general use.
+#  http://github.com/jim-easterbrook/pyctools-jim
+#  Copyright (C) 2026  Jim Easterbrook  jim@jim-easterbrook.me.uk
+#
+#  This program is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see
+#  <http://www.gnu.org/licenses/>.
+
+"""Catalog Kingswood picture files.
+
+Lists the dimensions, frame count and data type of every KW or pic-pipe
+file in a directory tree. Headers are read by a pool of worker threads
+and stored in an index file, so only new or changed files need to be
+read the next time the directory is listed.
+
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import json
+import logging
+import os
+import sys
+
+from pyctools.components.io.kwfilereader import probe
+
+logger = logging.getLogger(__name__)
+
+index_name = '.kwcatalog.json'
+
+
+def read_header(path):
+    try:
+        info = probe(path)
+    except Exception as ex:
+        # one bad file mustn't stop the whole catalog
+        logger.debug('%s: %s', path, str(ex))
+        return None
+    header = info.header._asdict()
+    header['data_type'] = header['data_type'].name
+    header['format'] = info.format
+    return header
+
+
+def catalog(root, pattern='*', index_path=None, workers=None):
+    """Get the headers of all KW or pic-pipe files in a directory tree.
+
+    The index file is updated if any files have been added, changed or
+    deleted. A file is assumed to be unchanged if its modification time
+    and size are the same as when it was indexed.
+
+    :param str root: The directory to search.
+
+    :param str pattern: Only read files whose names match this
+        :py:mod:`fnmatch` pattern.
+
+    :param str index_path: The index file. Defaults to
+        ``.kwcatalog.json`` in ``root``.
+
+    :param int workers: The number of worker threads. Defaults to
+        :py:class:`~concurrent.futures.ThreadPoolExecutor`'s default.
+
+    :return: A :py:class:`dict` of header values for each file, keyed
+        by path name relative to ``root``. Files that aren't KW or
+        pic-pipe files, or can't be read, have a value of
+        :py:data:`None`.
+
+    :rtype: :py:class:`dict`
+
+    """
+    if index_path is None:
+        index_path = os.path.join(root, index_name)
+    index = {}
+    if os.path.exists(index_path):
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError) as ex:
+            logger.warning('Ignoring index %s: %s', index_path, str(ex))
+    # find files
+    stamps = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in fnmatch.filter(filenames, pattern):
+            path = os.path.join(dirpath, name)
+            if os.path.abspath(path) == os.path.abspath(index_path):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError as ex:
+                # e.g. a broken symbolic link
+                logger.debug('%s: %s', path, str(ex))
+                stamps[os.path.relpath(path, root)] = None
+                continue
+            stamps[os.path.relpath(path, root)] = [
+                stat.st_mtime_ns, stat.st_size]
+    # use index entries that are still valid
+    result = {}
+    stale = []
+    for name, stamp in stamps.items():
+        if stamp and name in index and index[name]['stamp'] == stamp:
+            result[name] = index[name]
+        else:
+            stale.append(name)
+    # read new or changed files
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        headers = pool.map(
+            read_header, [os.path.join(root, x) for x in stale])
+        for name, header in zip(stale, headers):
+            result[name] = {'stamp': stamps[name], 'header': header}
+    if stale or len(result) != len(index):
+        # save updated index
+        try:
+            with open(index_path + '.tmp', 'w') as f:
+                json.dump(result, f)
+            os.replace(index_path + '.tmp', index_path)
+        except OSError as ex:
+            logger.warning('Cannot write index %s: %s', index_path, str(ex))
+    return {k: v['header'] for (k, v) in sorted(result.items())}
+
+
+def main():
+    # get command args
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('directory', help='directory to search')
+    parser.add_argument('-p', '--pattern', default='*',
+                        help='file name pattern, e.g. "*.kw"')
+    parser.add_argument('-i', '--index', metavar='path',
+                        help='index file (default {})'.format(index_name))
+    parser.add_argument('-j', '--jobs', type=int, metavar='n',
+                        help='number of worker threads')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='increase verbosity of log messages')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING - (args.verbose * 10))
+    headers = catalog(args.directory, pattern=args.pattern,
+                      index_path=args.index, workers=args.jobs)
+    for name, header in headers.items():
+        if not header:
+            continue
+        print('{len_x:5d} x {len_y:<5d} {comps:d} comps {len_z:6d} frames'
+              '  {data_type:15s} {format:8s} {code:4s} {name}'.format(
+                  name=name, **header))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())